@@ -1,11 +1,12 @@
 import random
-import math
-from itertools import chain
-import functools
-from menace_board import *
-from menace2 import *
-
-print = functools.partial(print, flush=True)
+import numpy as np
+from menace_board import get_state_index
+from menace_bitboard import INVERSE_SYMMETRIES
+from menace_batch import (DRAW, INVERSE_SYMMETRY_TABLE, LOSS, RESULT_LETTERS, WIN, canonicalize_boards,
+                          get_legal_actions, scatter_sums)
+from menace_engine import Engine
+from menace_game import PrintHooks, make_hooks, run_game
+from menace_metrics import METRICS
 
 def tuple_state_to_dict(st):
     st_list = []
@@ -19,306 +20,203 @@ def tuple_state_to_dict(st):
     st_dict = dict(zip(it, it))
     return st_dict
 
-class TokenBag:
-    def __init__(self, start_tokens=3):
-        board_dict = {}
-        for i in range(9):
-            board_dict[i] = start_tokens
-
-        self.token_counts = board_dict
-
-    def __str__(self):
-        return str(self.token_counts)
+DEFAULT_REWARDS = {'W': 3, 'D': 1, 'L': -1}
+REFILL_POLICIES = ('reset', 'uniform')
 
 class MatchBoxes:
-    def __init__(self):
+    def __init__(self, start_tokens=3, min_beads=0, refill='reset', dtype=np.int32, seed=None, legal=None):
+        # legal: the legal squares of each box, by default the canonical 3x3
+        # positions.
+        if refill not in REFILL_POLICIES:
+            raise ValueError(f"Unknown refill policy {refill!r}, expected one of {REFILL_POLICIES}")
+        self.start_tokens = start_tokens
+        self.min_beads = min_beads
+        self.refill = refill
+        self.legal = get_legal_actions() if legal is None else legal
+        self.beads = np.zeros(self.legal.shape, dtype=dtype)
+        self.rng = np.random.default_rng(seed)
         self.set_box_values()
 
-    def tuple_state_to_dict(self, st):
-        st_list = []
-        pos = 0
-        for i in st:
-            for j in i:
-                st_list.append(pos)
-                pos += 1
-                st_list.append(j)
-        it = iter(st_list)
-        st_dict = dict(zip(it, it))
-        return st_dict
+    def __len__(self):
+        return len(self.beads) - 1
 
     def set_box_values(self):
-        new_dict = {}
-        all_states = all_states_and_groups()
-        for key, value in all_states.items():
-            if value not in new_dict:
-                new_dict[value] = [TokenBag(), [key]]
-
-        for key, value in new_dict.items():
-            canonical_state = value[1][0]
-            new_dict[key][1] = get_symmetries(canonical_state)
-            board_state_dict = self.tuple_state_to_dict(new_dict[key][1][0])
-            for pos in board_state_dict:
-                if board_state_dict[pos] != 0:
-                    new_dict[key][0].token_counts[pos] = 0
-
-        self.boxes = new_dict
+        self.beads[:] = self.legal * self.start_tokens
 
-    def show_token_bag(self, box_number):
-        print(f"Token Bag for Box {box_number}: {self.boxes[box_number][0]}")
-        
-    def get_token(self, board_state):
-        board_position_symmetries = get_symmetries(((0, 1, 2), (3, 4, 5), (6, 7, 8)))
-        all_states = all_states_and_groups()
-        if board_state not in all_states:
-            print('ERROR: Board state not among allowed states.')
-            print_state(board_state)
-            return
+    def read_beads(self, box_numbers=None):
+        if box_numbers is None:
+            return self.beads.copy()
+        return self.beads[box_numbers]
 
-        box_number = all_states[board_state]
-        box = self.boxes[box_number]
+    def write_beads(self, counts, box_numbers=None):
+        if box_numbers is None:
+            self.beads[:] = counts * self.legal
+        else:
+            self.beads[box_numbers] = counts * self.legal[box_numbers]
 
-        total_tokens = sum(box[0].token_counts.values())
-        if total_tokens == 0:
-            box[0] = TokenBag()
-            board_state_dict = self.tuple_state_to_dict(box[1][0])
-            for pos in board_state_dict:
-                if board_state_dict[pos] != 0:
-                    box[0].token_counts[pos] = 0
+    def refill_boxes(self, box_numbers):
+        if METRICS.enabled:
+            METRICS.count('menace.refills', np.size(box_numbers))
+        if self.refill == 'reset':
+            self.beads[box_numbers] = self.legal[box_numbers] * self.start_tokens
+        else:
+            self.beads[box_numbers] += self.legal[box_numbers]
+
+    def add_beads(self, box_number, position, amount):
+        row = self.beads[box_number]
+        row[position] = max(row[position] + amount, self.min_beads)
+        if not row.any():
+            self.refill_boxes(box_number)
+
+    def add_beads_many(self, box_numbers, positions, amounts):
+        # Scatter-add over flat (box, bead) indices.
+        flat = np.asarray(box_numbers) * self.beads.shape[1] + np.asarray(positions)
+        beads = self.beads.reshape(-1)
+        touched, deltas, _ = scatter_sums(flat, np.broadcast_to(amounts, flat.shape), beads.size)
+        beads[touched] = np.maximum(beads[touched] + deltas.astype(beads.dtype), self.min_beads)
+        boxes = np.unique(touched // self.beads.shape[1])
+        empty = boxes[~self.beads[boxes].any(axis=1)]
+        if len(empty):
+            self.refill_boxes(empty)
+
+    def merge_deltas(self, deltas):
+        self.beads += np.sum(deltas, axis=0, dtype=self.beads.dtype)
+        np.maximum(self.beads, self.legal * self.min_beads, out=self.beads)
+        empty = np.flatnonzero(~self.beads.any(axis=1) & self.legal.any(axis=1))
+        if len(empty):
+            self.refill_boxes(empty)
+
+    def probabilities(self):
+        totals = self.beads.sum(axis=1, keepdims=True)
+        return self.beads / np.maximum(totals, 1)
+
+    def stats(self):
+        # Distribution of the bead totals over the boxes that have moves.
+        totals = self.beads[self.legal.any(axis=1)].sum(axis=1)
+        percentiles = np.percentile(totals, [0, 25, 50, 75, 100]).tolist()
+        return {'boxes': len(totals), 'beads': int(totals.sum()), 'empty_boxes': int((totals == 0).sum()),
+                'beads_per_box': dict(zip(('min', 'p25', 'median', 'p75', 'max'), percentiles))}
+
+    def show_token_bag(self, box_number):
+        print(f"Token Bag for Box {box_number}: {dict(enumerate(self.beads[box_number].tolist()))}")
+
+    def sample(self, box_numbers):
+        # One bead per box number, drawn in proportion to the bead counts.
+        return self.sample_counts(self.beads[box_numbers], box_numbers)
 
-            total_tokens = sum(box[0].token_counts.values())
+    def sample_counts(self, counts, box_numbers):
+        cumulative = counts.cumsum(axis=1)
+        totals = cumulative[:, -1]
+        if not totals.all():
+            raise ValueError(f"No tokens in boxes {np.asarray(box_numbers)[totals == 0].tolist()}")
+        draws = (self.rng.random(len(totals)) * totals).astype(cumulative.dtype)
+        return (cumulative <= draws[:, None]).sum(axis=1)
 
+    def get_token(self, board_state):
         try:
-            random_number = random.randint(1, total_tokens)
-        except ValueError:
-            print(f'ERROR: No tokens in box {box_number}. {box[0].token_counts}')
-            return
+            box_number, transform = get_state_index().positions[board_state]
+        except KeyError:
+            raise ValueError(f"Board state {board_state} is not among the allowed states") from None
 
-        tokens_counted = 0
-        for position, count in box[0].token_counts.items():
-            tokens_counted += count
-            if random_number <= tokens_counted:
+        counts = self.beads[box_number].tolist()
+        total_tokens = sum(counts)
+        if total_tokens == 0:
+            METRICS.count('menace.empty_boxes')
+            raise ValueError(f"No tokens in box {box_number}")
+
+        random_number = int(self.rng.random() * total_tokens)
+        chosen_token = 0
+        for position, count in enumerate(counts):
+            random_number -= count
+            if random_number < 0:
                 chosen_token = position
                 break
 
-        symmetry_state_index = box[1].index(board_state)
-        board_position_symmetry_dict = self.tuple_state_to_dict(board_position_symmetries[symmetry_state_index])
-        symmetry_position = [k for k, v in board_position_symmetry_dict.items() if v == chosen_token][0]
+        symmetry_position = INVERSE_SYMMETRIES[transform][chosen_token]
 
         return box_number, chosen_token, symmetry_position
-    
 
-class MenaceEngine:
-    def __init__(self, name):
-        self.boxes = MatchBoxes()
+    def get_tokens(self, board_states):
+        positions = get_state_index().positions
+        box_numbers, transforms = np.array([positions[board_state] for board_state in board_states]).reshape(-1, 2).T
+        chosen_tokens = self.sample(box_numbers)
+        symmetry_positions = INVERSE_SYMMETRY_TABLE[transforms, chosen_tokens]
+        return box_numbers, chosen_tokens, symmetry_positions
+
+
+class MenaceEngine(Engine):
+    def __init__(self, name, rewards=None, start_tokens=3, min_beads=0, refill='reset', seed=None, boxes=None):
+        # boxes replaces the default MatchBoxes built from the bead settings.
+        super().__init__(name)
+        if boxes is None:
+            boxes = MatchBoxes(start_tokens=start_tokens, min_beads=min_beads, refill=refill, seed=seed)
+        self.boxes = boxes
+        self.rewards = {**DEFAULT_REWARDS, **(rewards or {})}
         self.played_positions = []
-        self.is_learning = True
-        self.name = name
+
+    def move_probabilities(self):
+        return self.boxes.probabilities()
 
     def play(self, board_state):
         box_number, chosen_token, symmetry_position = self.boxes.get_token(board_state)
         self.played_positions.append((box_number, chosen_token))
         return symmetry_position
 
+    def play_many(self, boards, games):
+        box_numbers, transforms = canonicalize_boards(boards)
+        chosen_tokens = self.boxes.sample(box_numbers)
+        if self.is_learning:
+            self.batch_positions.append((games, box_numbers, chosen_tokens))
+        return INVERSE_SYMMETRY_TABLE[transforms, chosen_tokens]
+
     def resolve_game(self, result):
         if not self.is_learning:
             self.played_positions = []
             return
 
-        if result == 'W':
+        amount = self.rewards[result]
+        if amount:
             for box_number, position in self.played_positions:
-                self.boxes.set_box_values()
-        elif result == 'L':
-            # Handle the case for a loss
-            pass
-        elif result == 'D':
-            # Handle the case for a draw
-            pass
+                self.boxes.add_beads(box_number, position, amount)
 
         self.played_positions = []
 
-    def set_box_values(self):
-        new_dict = {}
-        all_states = all_states_and_groups()
-        for key, value in all_states.items():
-            if value not in new_dict:
-                new_dict[value] = [TokenBag(), [key]]
-
-        for key, value in new_dict.items():
-            canonical_state = value[1][0]
-            new_dict[key][1] = get_symmetries(canonical_state)
-            board_state_dict = self.tuple_state_to_dict(new_dict[key][1][0])
-            for pos in board_state_dict:
-                if board_state_dict[pos] != 0:
-                    new_dict[key][0].token_counts[pos] = 0
-
-        self.boxes = new_dict
-
-    def set_learning(self, is_learning):
-        self.is_learning = is_learning
-
-def play_game(playerA, playerB, to_print=True, to_return_winner=False):
-    if random.randint(0, 1) == 0:
-        player1, player2 = playerA, playerB
-    else:
-        player1, player2 = playerB, playerA
-
-    board_state = ((0, 0, 0), (0, 0, 0), (0, 0, 0))
-    is_game_over = False
-    winner = None
-    turn = 0
-    to_print = to_print
-
-    def tuple_state_to_list(st):
-        l = []
-        for t in st:
-            l.append(list(t))
-        return l
-
-    def list_state_to_tuple(st):
-        t = []
-        for l in st:
-            t.append(tuple(l))
-        return tuple(t)
-
-    if to_print:
-        print(f"Player 1: {player1.name} vs. Player 2: {player2.name}")
-        print(f"Turn {turn}")
-        print_state(board_state)
-        print('\n')
-    turn += 1
-
-    while not is_game_over:
-        position = player1.play(board_state)
-        board_state = tuple_state_to_list(board_state)
-        board_state[math.floor(position / 3)][position % 3] = 1
-        board_state = list_state_to_tuple(board_state)
-        if to_print:
-            print(f"Turn {turn}, {player1.name}")
-            print_state(board_state)
-            print('\n')
-        turn += 1
-        is_game_over = is_end(board_state)
-        if is_game_over:
-            winner = 1
-            if to_print:
-                print(f"{player1.name} wins!")
-            break
-
-        if list(chain.from_iterable(tuple_state_to_list(board_state))).count(0) == 0:
-            is_game_over = True
-            winner = 0
-            if to_print:
-                print("The game is a draw!")
-            break
-
-        position = player2.play(board_state)
-        board_state = tuple_state_to_list(board_state)
-        board_state[math.floor(position / 3)][position % 3] = 2
-        board_state = list_state_to_tuple(board_state)
-        if to_print:
-            print(f"Turn {turn}, {player2.name}")
-            print_state(board_state)
-            print('\n')
-        turn += 1
-        is_game_over = is_end(board_state)
-        if is_game_over:
-            winner = 2
-            if to_print:
-                print(f"{player2.name} wins!")
-            break
-
-    if is_game_over:
-        if winner == 1:
-            player1.resolve_game('W')
-            player2.resolve_game('L')
-            winning_player = player1.name
-        elif winner == 2:
-            player1.resolve_game('L')
-            player2.resolve_game('W')
-            winning_player = player2.name
-        else:
-            player1.resolve_game('D')
-            player2.resolve_game('D')
-            winning_player = 'Draw'
-
-    if to_return_winner:
-        return winning_player
-
-testEngineA = MenaceEngine(name='testEngineA')
-testEngineB = MenaceEngine(name='testEngineB')
-play_game(testEngineA, testEngineB, to_print=True)
-testEngineA.boxes.show_token_bag(1)
-
-for i in range(100):
-    play_game(testEngineA, testEngineB, to_print=False)
-
-play_game(testEngineA, testEngineB, to_print=True)
-
-for i in range(1000):
-    play_game(testEngineA, testEngineB, to_print=False)
+    def learn_batch(self, games, box_numbers, chosen_tokens, results):
+        # One bead update per move, all at once: the move chosen_tokens[i]
+        # from box_numbers[i] was played in game games[i], which ended with
+        # results[games[i]] (WIN, DRAW or LOSS) for this engine.
+        amounts = np.array([self.rewards[RESULT_LETTERS[code]] for code in (LOSS, DRAW, WIN)])
+        self.boxes.add_beads_many(box_numbers, chosen_tokens, amounts[results[games] - LOSS])
 
-play_game(testEngineA, testEngineB, to_print=True)
-
-draws_and_games = [0, 0]
-for i in range(100):
-    result = play_game(testEngineA, testEngineB, to_print=False, to_return_winner=True)
-    draws_and_games[1] += 1
-    if result == 'Draw':
-        draws_and_games[0] += 1
+    def set_box_values(self):
+        self.boxes.set_box_values()
 
-print(f"{(draws_and_games[0] / draws_and_games[1] * 100):.0f}% of games end in a draw.")
+    def stats(self):
+        return self.boxes.stats()
 
-for i in range(1000):
-    play_game(testEngineA, testEngineB, to_print=False)
-    draws_and_games = [0, 0]
-    for i in range(100):
-        result = play_game(testEngineA, testEngineB, to_print=False, to_return_winner=True)
-        draws_and_games[1] += 1
-        if result == 'Draw':
-            draws_and_games[0] += 1
+    def set_seed(self, seed):
+        self.boxes.rng = np.random.default_rng(seed)
 
-    print(f"{(draws_and_games[0] / draws_and_games[1] * 100):.0f}% of games end in a draw.")
+    def get_config(self):
+        return {'name': self.name, 'rewards': dict(self.rewards), 'start_tokens': self.boxes.start_tokens,
+                'min_beads': self.boxes.min_beads, 'refill': self.boxes.refill}
 
-for i in range(5000):
-    play_game(testEngineA, testEngineB, to_print=False)
-    draws_and_games = [0, 0]
-    for i in range(100):
-        result = play_game(testEngineA, testEngineB, to_print=False, to_return_winner=True)
-        draws_and_games[1] += 1
-        if result == 'Draw':
-            draws_and_games[0] += 1
+    def get_policy(self):
+        return self.boxes.beads
 
-    print(f"{(draws_and_games[0] / draws_and_games[1] * 100):.0f}% of games end in a draw.")
+    def set_policy(self, policy):
+        self.boxes.beads = policy
 
-play_game(testEngineA, testEngineB, to_print=True)
+    def merge_policy_deltas(self, deltas):
+        self.boxes.merge_deltas(deltas)
 
-class HumanPlayer:
-    def __init__(self, name):
-        self.name = name
+def play_game(playerA, playerB, to_print=True, to_return_winner=False, log=None):
+    if random.randint(0, 1) == 0:
+        player1, player2 = playerA, playerB
+    else:
+        player1, player2 = playerB, playerA
 
-    def play(self, board_state):
-        print("Enter a position (0-8):")
-        position = int(input())
-        return position
+    winner = run_game(player1, player2, hooks=make_hooks(PrintHooks() if to_print else None, log))
 
-    def resolve_game(self, result):
-        pass
-
-play_game(HumanPlayer('I, the player'), testEngineA, to_print=True)
-
-untrainedMENACE = MenaceEngine(name='untrainedMENACE')
-untrainedMENACE.set_learning(False)
-play_game(untrainedMENACE, testEngineA, to_print=True)
-
-untrainedwins_and_games = [0, 0, 0]
-for i in range(100):
-    result = play_game(untrainedMENACE, testEngineA, to_print=False, to_return_winner=True)
-    untrainedwins_and_games[2] += 1
-    if result == 'untrainedMENACE':
-        untrainedwins_and_games[0] += 1
-    if result == 'Draw':
-        untrainedwins_and_games[1] += 1
-
-print(
-    f"The untrained engine wins {(untrainedwins_and_games[0] / untrainedwins_and_games[2] * 100):.0f}% \
-of games and {(untrainedwins_and_games[1] / untrainedwins_and_games[2] * 100):.0f}% end in a draw.")
+    if to_return_winner:
+        return (('Draw', player1.name, player2.name))[winner]
@@ -90,10 +90,7 @@ def get_next_states_raw(st: State, step: int) -> List[State]:
 
 
 def add_symmetry_group(st: State, gid: GroupId, states, groups) -> None:
-    print(f"Adding symmetry group with ID {gid}")
-    print(f"Current groups: {groups}")
     assert gid not in groups
     symmetry_group = get_symmetries(st)
     groups[gid] = symmetry_group
     states.update({st: gid for st in symmetry_group})
-    print(f"Updated groups: {groups}")
@@ -0,0 +1,262 @@
+from functools import lru_cache
+from time import perf_counter
+
+import numpy as np
+
+from menace_bitboard import CELL_MASK, INVERSE_SYMMETRIES, IS_WIN, N_SQUARES, SYMMETRIES, TIC_TAC_TOE, Geometry
+from menace_board import get_state_index
+from menace_metrics import METRICS
+
+WIN = 1
+DRAW = 0
+LOSS = -1
+RESULT_LETTERS = {WIN: 'W', DRAW: 'D', LOSS: 'L'}
+
+WIN_TABLE = np.array(IS_WIN, dtype=bool)
+SYMMETRY_TABLE = np.array(SYMMETRIES)
+INVERSE_SYMMETRY_TABLE = np.array(INVERSE_SYMMETRIES)
+BOARD_SIZE = 1 << (2 * N_SQUARES)
+
+_board_positions = None
+_legal_actions = None
+_afterstates = None
+
+
+def get_board_positions():
+    # Dense (group id, transform) lookup for every 18-bit board, -1 where the
+    # board is not reachable, so that a whole array of boards can be
+    # canonicalized with two fancy-indexing operations.
+    global _board_positions
+    if _board_positions is None:
+        group_ids = np.full(BOARD_SIZE, -1, dtype=np.int32)
+        transforms = np.full(BOARD_SIZE, -1, dtype=np.int8)
+        for board, (gid, transform) in get_state_index().board_positions.items():
+            group_ids[board] = gid
+            transforms[board] = transform
+        group_ids.setflags(write=False)
+        transforms.setflags(write=False)
+        _board_positions = group_ids, transforms
+    return _board_positions
+
+
+def get_legal_actions():
+    # (n_groups + 1, 9) bool, row = group id (row 0 unused): the empty squares
+    # of each group's canonical state.
+    global _legal_actions
+    if _legal_actions is None:
+        state_index = get_state_index()
+        legal = np.zeros((len(state_index) + 1, N_SQUARES), dtype=bool)
+        for gid, canonical_state in state_index.canonical.items():
+            legal[gid] = [val == 0 for row in canonical_state for val in row]
+        legal.setflags(write=False)
+        _legal_actions = legal
+    return _legal_actions
+
+
+def get_afterstates():
+    # (n_groups + 1, 9) int32, row = group id: the group id of the position
+    # each canonical move leads to, 0 where the square is taken or the game
+    # is over.
+    global _afterstates
+    if _afterstates is None:
+        graph = get_state_index().graph
+        afterstates = np.zeros((len(graph.codes), N_SQUARES), dtype=np.int32)
+        afterstates[graph.edge_sources(), graph.moves] = graph.successors
+        afterstates.setflags(write=False)
+        _afterstates = afterstates
+    return _afterstates
+
+
+def scatter_sums(flat, weights, size):
+    # (distinct indices, summed weights, counts) of flat indices into a table
+    # of the given size. bincount over the whole table is fastest unless the
+    # table is much bigger than the batch.
+    if size <= 4 * len(flat):
+        counts = np.bincount(flat, minlength=size)
+        touched = np.flatnonzero(counts)
+        return touched, np.bincount(flat, weights=weights, minlength=size)[touched], counts[touched]
+    touched, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+    return touched, np.bincount(inverse, weights=weights, minlength=len(touched)), counts
+
+
+def canonicalize_boards(boards):
+    group_ids, transforms = get_board_positions()
+    return group_ids[boards], transforms[boards]
+
+
+def occupied_masks(boards):
+    return (boards | boards >> N_SQUARES) & CELL_MASK
+
+
+def legal_move_masks(boards):
+    # (len(boards), 9) bool, True where the square is empty.
+    return (occupied_masks(boards)[:, None] >> np.arange(N_SQUARES) & 1) == 0
+
+
+def apply_moves(boards, squares, player):
+    return boards | np.left_shift(1, squares + N_SQUARES * (player - 1), dtype=boards.dtype)
+
+
+def have_won(boards, player):
+    return WIN_TABLE[boards >> (N_SQUARES * (player - 1)) & CELL_MASK]
+
+
+def are_full(boards):
+    return occupied_masks(boards) == CELL_MASK
+
+
+class BoardArrays:
+    # The rules of one Geometry for int64 arrays of bitboards, which holds
+    # boards of up to 31 squares. Unlike 3x3 there is no table of every
+    # reachable board, so canonicalize works from the bits alone.
+    def __init__(self, geometry: Geometry):
+        if 2 * geometry.n_squares > 63:
+            raise ValueError(f"{geometry} boards do not fit in 64 bits")
+        n = geometry.n_squares
+        self.geometry = geometry
+        self.n_squares = n
+        self.cell_mask = geometry.cell_mask
+        self.win_masks = np.array(geometry.win_masks, dtype=np.int64)
+        self.win_table = None if geometry.is_win is None else np.array(geometry.is_win, dtype=bool)
+        self.symmetry_table = np.array(geometry.symmetries)
+        self.inverse_symmetry_table = np.array(geometry.inverse_symmetries)
+        # _chunks[t, c, byte]: the bits of byte c of a board, moved through the
+        # inverse of transform t and OR-ed together over the bytes.
+        self.n_chunks = -(-2 * n // 8)
+        self._chunks = np.zeros((geometry.n_symmetries, self.n_chunks, 256), dtype=np.int64)
+        for t, perm in enumerate(geometry.symmetries):
+            for bit in range(2 * n):
+                player_offset = bit - bit % n
+                values = np.flatnonzero(np.arange(256) >> bit % 8 & 1)
+                self._chunks[t, bit // 8, values] |= 1 << (player_offset + perm[bit - player_offset])
+        self._shifts = np.arange(self.n_chunks, dtype=np.int64)[:, None] * 8
+
+    def occupied_masks(self, boards):
+        return (boards | boards >> self.n_squares) & self.cell_mask
+
+    def legal_move_masks(self, boards):
+        # (len(boards), n_squares) bool, True where the square is empty.
+        return (self.occupied_masks(boards)[:, None] >> np.arange(self.n_squares) & 1) == 0
+
+    def apply_moves(self, boards, squares, player):
+        return boards | np.left_shift(1, squares + self.n_squares * (player - 1), dtype=boards.dtype)
+
+    def are_legal(self, boards, squares):
+        # True where squares[i] is an empty square of boards[i].
+        on_board = (squares >= 0) & (squares < self.n_squares)
+        return on_board & (self.occupied_masks(boards) >> np.where(on_board, squares, 0) & 1 == 0)
+
+    def have_won(self, boards, player):
+        masks = boards >> (self.n_squares * (player - 1)) & self.cell_mask
+        if self.win_table is not None:
+            return self.win_table[masks]
+        return ((masks[:, None] & self.win_masks) == self.win_masks).any(axis=1)
+
+    def are_full(self, boards):
+        return self.occupied_masks(boards) == self.cell_mask
+
+    def canonicalize(self, boards):
+        # (canonical boards, transforms) as Geometry.canonicalize: each board
+        # is transform_board(canonical, transform), canonical is the smallest.
+        chunks = boards[None, :] >> self._shifts & 255
+        candidates = np.bitwise_or.reduce(self._chunks[:, np.arange(self.n_chunks)[:, None], chunks], axis=1)
+        transforms = candidates.argmin(axis=0)
+        return candidates[transforms, np.arange(len(boards))], transforms
+
+
+@lru_cache(maxsize=None)
+def get_board_arrays(geometry: Geometry = TIC_TAC_TOE) -> BoardArrays:
+    return BoardArrays(geometry)
+
+
+def game_geometry(playerA, playerB, geometry=None):
+    # The board two players play on. Players without a geometry attribute
+    # play 3x3; a geometry of None plays on any board. geometry, if given,
+    # must agree with the players'.
+    own = [getattr(player, 'geometry', TIC_TAC_TOE) for player in (playerA, playerB)]
+    geometries = [board for board in own + [geometry] if board is not None]
+    if any(board != geometries[0] for board in geometries):
+        raise ValueError(f"{playerA.name} plays on {own[0]} and {playerB.name} on {own[1]}"
+                         + ("" if geometry is None else f", not {geometry}"))
+    return geometries[0] if geometries else TIC_TAC_TOE
+
+
+def play_batch(playerA, playerB, n_games, rng=None, log=None, geometry=None):
+    # Plays n_games independent games in lockstep and returns playerA's result
+    # (WIN, DRAW or LOSS) for each of them. Each player moves through
+    # play_many(boards, games) and learns through resolve_many(results), both
+    # indexed by game number within the batch. Who moves first is drawn per game.
+    # The games are passed to log.write_batch if a log is given. The board
+    # is the players' own (see game_geometry); logs only hold 3x3 games.
+    arrays = get_board_arrays(game_geometry(playerA, playerB, geometry))
+    if log is not None and arrays.geometry != TIC_TAC_TOE:
+        raise ValueError(f"Game logs only hold 3x3 games, not {arrays.geometry}")
+    rng = np.random.default_rng(rng)
+    boards = np.zeros(n_games, dtype=np.int64)
+    a_first = rng.random(n_games) < 0.5
+    winners = np.zeros(n_games, dtype=np.int8)
+    active = np.arange(n_games)
+    if log is not None:
+        moves = np.zeros((n_games, N_SQUARES), dtype=np.uint8)
+        n_moves = np.zeros(n_games, dtype=np.uint8)
+    timed = METRICS.enabled
+
+    for ply in range(arrays.n_squares):
+        if not len(active):
+            break
+        player = ply % 2 + 1
+        a_moves = a_first[active] if player == 1 else ~a_first[active]
+        for engine, games in ((playerA, active[a_moves]), (playerB, active[~a_moves])):
+            if len(games):
+                if timed:
+                    start = perf_counter()
+                squares = engine.play_many(boards[games], games)
+                if timed:
+                    moved = perf_counter()
+                    METRICS.add_time('batch.move_selection', moved - start)
+                illegal = ~arrays.are_legal(boards[games], squares)
+                if illegal.any():
+                    game = np.flatnonzero(illegal)[0]
+                    board = arrays.geometry.decode_board(int(boards[games[game]]))
+                    raise ValueError(f"Illegal move {int(squares[game])} by {engine.name} on\n{board}")
+                boards[games] = arrays.apply_moves(boards[games], squares, player)
+                if log is not None:
+                    moves[games, ply] = squares
+                    n_moves[games] = ply + 1
+                if timed:
+                    METRICS.add_time('batch.board_update', perf_counter() - moved)
+
+        if timed:
+            start = perf_counter()
+        won = arrays.have_won(boards[active], player)
+        winners[active[won]] = player
+        active = active[~won & ~arrays.are_full(boards[active])]
+        if timed:
+            METRICS.add_time('batch.terminal_check', perf_counter() - start)
+
+    a_player = np.where(a_first, 1, 2)
+    results = np.where(winners == 0, DRAW, np.where(winners == a_player, WIN, LOSS)).astype(np.int8)
+    if log is not None:
+        log.write_batch(playerA.name, playerB.name, a_first, moves, n_moves, winners)
+    if timed:
+        start = perf_counter()
+    playerA.resolve_many(results)
+    playerB.resolve_many(-results)
+    if timed:
+        METRICS.add_time('batch.learning_update', perf_counter() - start)
+        METRICS.count('batch.games', n_games)
+        METRICS.count('batch.batches')
+    return results
+
+
+def simulate(playerA, playerB, n_games, batch_size=10000, rng=None, log=None, geometry=None):
+    # Plays n_games in batches of batch_size and returns playerA's
+    # (wins, draws, losses).
+    rng = np.random.default_rng(rng)
+    totals = np.zeros(3, dtype=np.int64)
+    while n_games > 0:
+        results = play_batch(playerA, playerB, min(batch_size, n_games), rng, log, geometry)
+        totals += np.bincount(results + 1, minlength=3)[::-1]
+        n_games -= batch_size
+    wins, draws, losses = totals.tolist()
+    return wins, draws, losses
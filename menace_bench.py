@@ -0,0 +1,190 @@
+import argparse
+import fnmatch
+import functools
+import json
+import platform
+import sys
+import time
+import timeit
+
+import numpy as np
+
+from menace import MatchBoxes, MenaceEngine
+from menace import play_game as menace_play_game
+from menace_batch import simulate
+from menace_board import StateIndex, build_state_graph, get_symmetries, is_end, make_move
+from menace_evaluation import evaluate
+from menace_qlearning import AfterstateEngine, QLearningEngine
+from menace_qlearning import play_game as qlearning_play_game
+from menace_solver import OptimalPlayer, solve
+
+print = functools.partial(print, flush=True)
+
+# Each benchmark returns (value, unit); units ending in '/s' are throughputs,
+# where higher is better, everything else is a time, where lower is better.
+BENCHMARKS = {}
+MID_GAME = ((1, 2, 0), (0, 1, 0), (2, 0, 0))
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def time_per_call(func, repeat=5):
+    # Best of repeat runs, each long enough to be timed reliably.
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number, 's/call'
+
+
+@benchmark('micro.is_end')
+def bench_is_end():
+    return time_per_call(lambda: is_end(MID_GAME))
+
+
+@benchmark('micro.get_symmetries')
+def bench_get_symmetries():
+    return time_per_call(lambda: get_symmetries(MID_GAME))
+
+
+@benchmark('micro.make_move')
+def bench_make_move():
+    return time_per_call(lambda: make_move(MID_GAME, 2, 2, 1))
+
+
+@benchmark('micro.all_states_and_groups')
+def bench_all_states_and_groups():
+    return time_per_call(lambda: StateIndex(build_state_graph()), repeat=3)
+
+
+@benchmark('micro.get_token')
+def bench_get_token():
+    boxes = MatchBoxes(seed=0)
+    return time_per_call(lambda: boxes.get_token(MID_GAME))
+
+
+@benchmark('micro.frozen_play')
+def bench_frozen_play():
+    player = MenaceEngine('bench', seed=0).freeze(seed=0)
+    return time_per_call(lambda: player.play(MID_GAME))
+
+
+@benchmark('micro.update_q_table')
+def bench_update_q_table():
+    engine = QLearningEngine('bench', seed=0)
+    next_state = make_move(MID_GAME, 2, 2, 1)
+    return time_per_call(lambda: engine.update_q_table(MID_GAME, 8, 0.0, next_state))
+
+
+def self_play_rate(play_game, engineA, engineB, n_games):
+    start = time.perf_counter()
+    for _ in range(n_games):
+        play_game(engineA, engineB, to_print=False)
+    return n_games / (time.perf_counter() - start), 'games/s'
+
+
+@benchmark('macro.menace_self_play')
+def bench_menace_self_play():
+    return self_play_rate(menace_play_game, MenaceEngine('A', seed=0), MenaceEngine('B', seed=1), 2000)
+
+
+@benchmark('macro.qlearning_self_play')
+def bench_qlearning_self_play():
+    return self_play_rate(qlearning_play_game, QLearningEngine('A', seed=0), QLearningEngine('B', seed=1), 2000)
+
+
+@benchmark('macro.menace_batch_self_play')
+def bench_menace_batch_self_play():
+    n_games = 100000
+    start = time.perf_counter()
+    simulate(MenaceEngine('A', seed=0), MenaceEngine('B', seed=1), n_games, batch_size=10000, rng=0)
+    return n_games / (time.perf_counter() - start), 'games/s'
+
+
+def time_to_draw_rate(engineA, engineB, target=0.75, chunk=1000, max_games=200000):
+    # Wall time of batched self-play until engineA draws against a perfect
+    # player with (exact) probability target.
+    optimal = OptimalPlayer()
+    solve()
+    games = 0
+    start = time.perf_counter()
+    while games < max_games:
+        simulate(engineA, engineB, chunk, batch_size=chunk, rng=games)
+        games += chunk
+        if evaluate(engineA, optimal)[1] >= target:
+            return time.perf_counter() - start, 's'
+    return float('inf'), 's'
+
+
+@benchmark('macro.menace_time_to_draw_rate')
+def bench_menace_time_to_draw_rate():
+    return time_to_draw_rate(MenaceEngine('A', seed=0), MenaceEngine('B', seed=1))
+
+
+@benchmark('macro.qlearning_time_to_draw_rate')
+def bench_qlearning_time_to_draw_rate():
+    return time_to_draw_rate(QLearningEngine('A', exploration_rate=0.1, seed=0),
+                             QLearningEngine('B', exploration_rate=0.1, seed=1))
+
+
+@benchmark('macro.afterstate_time_to_draw_rate')
+def bench_afterstate_time_to_draw_rate():
+    return time_to_draw_rate(AfterstateEngine('A', exploration_rate=0.1, seed=0),
+                             AfterstateEngine('B', exploration_rate=0.1, seed=1))
+
+
+def run(pattern='*'):
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if fnmatch.fnmatch(name, pattern):
+            value, unit = func()
+            results[name] = {'value': value, 'unit': unit}
+            print(f"{name:40s} {value:12.4g} {unit}")
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'benchmarks': results}
+
+
+def compare(report, baseline, tolerance):
+    # Returns the names of benchmarks that got worse than baseline by more
+    # than the tolerance (a fraction).
+    regressions = []
+    for name, result in report['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        old, new = baseline['benchmarks'][name]['value'], result['value']
+        change = old / new - 1 if result['unit'].endswith('/s') else new / old - 1
+        flag = change > tolerance
+        if flag:
+            regressions.append(name)
+        print(f"{name:40s} {change * 100:+8.1f}% slower{'  REGRESSION' if flag else ''}")
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the board primitives and the engines.")
+    parser.add_argument('--filter', default='*', help="only run benchmarks whose name matches this glob")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="compare against results previously written with --output")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="flag benchmarks that are slower than the baseline by more than this fraction")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = run(args.filter)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
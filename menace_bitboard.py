@@ -0,0 +1,249 @@
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+
+# A board is a single int holding two 9-bit masks: bits 0-8 are the squares of
+# player 1 and bits 9-17 the squares of player 2, square = 3 * row + col.
+Board = int
+Square = int
+
+N_SQUARES = 9
+CELL_MASK = (1 << N_SQUARES) - 1
+EMPTY_BOARD: Board = 0
+FULL_MASK = CELL_MASK
+
+
+def _win_lines(rows: int, cols: int, k: int) -> List[Tuple[Square, ...]]:
+    # Every run of k squares along a row, a column, a diagonal and an
+    # anti-diagonal, in that order.
+    lines = []
+    for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        for row in range(rows):
+            for col in range(cols):
+                end_row, end_col = row + d_row * (k - 1), col + d_col * (k - 1)
+                if 0 <= end_row < rows and 0 <= end_col < cols:
+                    lines.append(tuple((row + d_row * i) * cols + col + d_col * i for i in range(k)))
+    return lines
+
+
+def _symmetries(rows: int, cols: int) -> Tuple[Tuple[Square, ...], ...]:
+    # A transformed board has, on square i, the piece found on square
+    # perm[i] of the original board. Square boards have the 8 dihedral
+    # transforms: identity, three quarter turns, then the vertical mirror and
+    # its three quarter turns. Other boards only have the half turn.
+    n_squares = rows * cols
+    mirror = tuple((rows - 1 - row) * cols + col for row in range(rows) for col in range(cols))
+    if rows == cols:
+        turn, n_turns = tuple((rows - 1 - col) * cols + row for row in range(rows) for col in range(cols)), 4
+    else:
+        turn, n_turns = tuple(range(n_squares))[::-1], 2
+
+    def turns(perm):
+        perms = [perm]
+        for _ in range(n_turns - 1):
+            perms.append(tuple(perms[-1][turn[i]] for i in range(n_squares)))
+        return perms
+
+    return tuple(turns(tuple(range(n_squares))) + turns(mirror))
+
+
+class Geometry:
+    # An m,n,k game: a rows x cols board on which k in a row wins. Boards are
+    # ints laid out as for 3x3, player 1 in the low n_squares bits and
+    # player 2 above them, square = cols * row + col.
+    def __init__(self, rows: int = 3, cols: int = 3, k: int = 3):
+        if rows < 1 or cols < 1 or not 1 <= k <= max(rows, cols):
+            raise ValueError(f"No {rows}x{cols} board has {k} in a row")
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.n_squares = n_squares = rows * cols
+        self.cell_mask = (1 << n_squares) - 1
+        self.win_lines = tuple(_win_lines(rows, cols, k))
+        self.win_masks = tuple(sum(1 << sq for sq in line) for line in self.win_lines)
+        self.symmetries = _symmetries(rows, cols)
+        self.inverse_symmetries = tuple(tuple(perm.index(sq) for sq in range(n_squares)) for perm in self.symmetries)
+        self.n_symmetries = len(self.symmetries)
+        # inverse_transforms[t] undoes transform t.
+        self.inverse_transforms = tuple(self.inverse_symmetries.index(perm) for perm in self.symmetries)
+        self.move_bits = ((), tuple(1 << sq for sq in range(n_squares)),
+                          tuple(1 << (sq + n_squares) for sq in range(n_squares)))
+        # Small boards look wins up by mask, like the 3x3 tables below.
+        self.is_win = None
+        if n_squares <= 12:
+            self.is_win = tuple(any(mask & w == w for w in self.win_masks) for mask in range(1 << n_squares))
+
+    def __repr__(self) -> str:
+        return f"Geometry({self.rows}, {self.cols}, {self.k})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Geometry) and self.config() == other.config()
+
+    def __hash__(self) -> int:
+        return hash(self.config())
+
+    def config(self) -> Tuple[int, int, int]:
+        return self.rows, self.cols, self.k
+
+    def player_mask(self, board: Board, player: int) -> int:
+        return board >> (self.n_squares * (player - 1)) & self.cell_mask
+
+    def occupied_mask(self, board: Board) -> int:
+        return (board | board >> self.n_squares) & self.cell_mask
+
+    def apply_move(self, board: Board, square: Square, player: int) -> Board:
+        return board | self.move_bits[player][square]
+
+    def has_won(self, board: Board, player: int) -> bool:
+        mask = board >> (self.n_squares * (player - 1)) & self.cell_mask
+        if self.is_win is not None:
+            return self.is_win[mask]
+        return any(mask & w == w for w in self.win_masks)
+
+    def is_won(self, board: Board) -> bool:
+        return self.has_won(board, 1) or self.has_won(board, 2)
+
+    def is_full(self, board: Board) -> bool:
+        return self.occupied_mask(board) == self.cell_mask
+
+    def legal_moves(self, board: Board) -> Tuple[Square, ...]:
+        occupied = self.occupied_mask(board)
+        return tuple(sq for sq in range(self.n_squares) if not occupied >> sq & 1)
+
+    def transform_board(self, board: Board, transform: int) -> Board:
+        inverse = self.inverse_symmetries[transform]
+        transformed = 0
+        while board:
+            lowest = board & -board
+            bit = lowest.bit_length() - 1
+            player_offset = bit - bit % self.n_squares
+            transformed |= 1 << (player_offset + inverse[bit - player_offset])
+            board ^= lowest
+        return transformed
+
+    def canonicalize(self, board: Board) -> Tuple[Board, int]:
+        # (canonical board, transform) with board = transform_board(canonical,
+        # transform); the canonical board is the smallest of the symmetries.
+        return min((self.transform_board(board, inverse), transform)
+                   for transform, inverse in enumerate(self.inverse_transforms))
+
+    def encode_state(self, st: Iterable[Iterable[int]]) -> Board:
+        board = EMPTY_BOARD
+        for sq, val in enumerate(val for row in st for val in row):
+            if val:
+                board |= self.move_bits[val][sq]
+        return board
+
+    def decode_board(self, board: Board) -> Tuple[Tuple[int, ...], ...]:
+        if self.rows == self.cols == 3:
+            return decode_board(board)
+        n = self.n_squares
+        cells = [board >> sq & 1 | (board >> (sq + n) & 1) << 1 for sq in range(n)]
+        return tuple(tuple(cells[row * self.cols:(row + 1) * self.cols]) for row in range(self.rows))
+
+
+@lru_cache(maxsize=None)
+def get_geometry(rows: int = 3, cols: int = 3, k: int = 3) -> Geometry:
+    return Geometry(rows, cols, k)
+
+
+TIC_TAC_TOE = get_geometry(3, 3, 3)
+
+WIN_LINES = TIC_TAC_TOE.win_lines
+WIN_MASKS = TIC_TAC_TOE.win_masks
+
+# Indexed by a 9-bit mask of one player's squares.
+IS_WIN = TIC_TAC_TOE.is_win
+# Indexed by a 9-bit mask of the occupied squares.
+LEGAL_MOVES = tuple(
+    tuple(sq for sq in range(N_SQUARES) if not occupied >> sq & 1) for occupied in range(1 << N_SQUARES)
+)
+# The 8 dihedral transforms as square permutations, in the order produced by
+# menace_board.get_symmetries: identity, three rotations, then the vertical
+# mirror and its three rotations. A transformed board has, on square i, the
+# piece found on square SYMMETRIES[t][i] of the original board.
+SYMMETRIES = TIC_TAC_TOE.symmetries
+INVERSE_SYMMETRIES = TIC_TAC_TOE.inverse_symmetries
+N_SYMMETRIES = len(SYMMETRIES)
+
+
+def _permuted_masks(inverse: Tuple[Square, ...]) -> Tuple[int, ...]:
+    # Every 9-bit mask moved through the transform with the given inverse
+    # permutation, built from the mask without its lowest set bit.
+    masks = [0] * (1 << N_SQUARES)
+    for mask in range(1, 1 << N_SQUARES):
+        lowest = mask & -mask
+        masks[mask] = masks[mask ^ lowest] | 1 << inverse[lowest.bit_length() - 1]
+    return tuple(masks)
+
+
+# SYMMETRY_MASKS[t][mask] is a 9-bit mask moved through transform t.
+SYMMETRY_MASKS = tuple(_permuted_masks(inverse) for inverse in INVERSE_SYMMETRIES)
+
+# MOVE_BITS[player][square], player is 1 or 2.
+MOVE_BITS = (
+    (),
+    tuple(1 << sq for sq in range(N_SQUARES)),
+    tuple(1 << (sq + N_SQUARES) for sq in range(N_SQUARES)),
+)
+
+
+def player_mask(board: Board, player: int) -> int:
+    return board >> (N_SQUARES * (player - 1)) & CELL_MASK
+
+
+def occupied_mask(board: Board) -> int:
+    return (board | board >> N_SQUARES) & CELL_MASK
+
+
+def apply_move(board: Board, square: Square, player: int) -> Board:
+    return board | MOVE_BITS[player][square]
+
+
+def undo_move(board: Board, square: Square, player: int) -> Board:
+    return board & ~MOVE_BITS[player][square]
+
+
+def has_won(board: Board, player: int) -> bool:
+    return IS_WIN[board >> (N_SQUARES * (player - 1)) & CELL_MASK]
+
+
+def is_won(board: Board) -> bool:
+    return IS_WIN[board & CELL_MASK] or IS_WIN[board >> N_SQUARES]
+
+
+def is_full(board: Board) -> bool:
+    return (board | board >> N_SQUARES) & CELL_MASK == FULL_MASK
+
+
+def legal_moves(board: Board) -> Tuple[Square, ...]:
+    return LEGAL_MOVES[(board | board >> N_SQUARES) & CELL_MASK]
+
+
+def transform_board(board: Board, transform: int) -> Board:
+    masks = SYMMETRY_MASKS[transform]
+    return masks[board & CELL_MASK] | masks[board >> N_SQUARES] << N_SQUARES
+
+
+def cell(board: Board, square: Square) -> int:
+    if board >> square & 1:
+        return 1
+    if board >> (square + N_SQUARES) & 1:
+        return 2
+    return 0
+
+
+def encode_state(st: Iterable[Iterable[int]]) -> Board:
+    board = EMPTY_BOARD
+    sq = 0
+    for row in st:
+        for val in row:
+            if val:
+                board |= MOVE_BITS[val][sq]
+            sq += 1
+    return board
+
+
+@lru_cache(maxsize=None)
+def decode_board(board: Board) -> Tuple[Tuple[int, ...], ...]:
+    cells = [cell(board, sq) for sq in range(N_SQUARES)]
+    return tuple(tuple(cells[row * 3:row * 3 + 3]) for row in range(3))
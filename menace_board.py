@@ -1,15 +1,25 @@
-from collections import deque
-from typing import Iterable, List
+import threading
+from numbers import Integral
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from menace_bitboard import (EMPTY_BOARD, N_SYMMETRIES, Board, Geometry, apply_move, decode_board, encode_state,
+                             get_geometry, is_full, is_won, legal_moves, occupied_mask, transform_board)
 
 State = Iterable[Iterable[int]]
 SymmetryGroup = List[State]
 GroupId = int
+# (group id, transform index): the state is SYMMETRIES[transform] applied to
+# the canonical state of the group.
+Position = Tuple[GroupId, int]
 
-
-class Node:
-    def __init__(self, val: GroupId = None, successors: List[GroupId] = None):
-        self.val = val
-        self.successors = successors or []
+# StateGraph outcomes besides the winning player (1 or 2).
+ONGOING = -1
+DRAW = 0
+# Group id of the empty board.
+ROOT: GroupId = 1
 
 
 def state_str(st: State) -> str:
@@ -24,37 +34,45 @@ def print_state(st: State) -> None:
 
 
 def get_symmetries(st: State) -> SymmetryGroup:
+    # Works for any rectangular state; boards that are not square only have
+    # the half turn besides the mirror images.
     def get_vertical_mirror(st: State) -> State:
         return tuple(reversed(st))
 
     def get_rotations(st: State) -> List[State]:
-        ((a, b, c), (d, e, f), (g, h, i)) = st
-        rot1 = ((g, d, a), (h, e, b), (i, f, c))
-        rot2 = ((i, h, g), (f, e, d), (c, b, a))
-        rot3 = ((c, f, i), (b, e, h), (a, d, g))
+        if len(st) == 3 and len(st[0]) == 3:
+            ((a, b, c), (d, e, f), (g, h, i)) = st
+            rot1 = ((g, d, a), (h, e, b), (i, f, c))
+            rot2 = ((i, h, g), (f, e, d), (c, b, a))
+            rot3 = ((c, f, i), (b, e, h), (a, d, g))
+            return [st, rot1, rot2, rot3]
+        rot2 = tuple(tuple(reversed(row)) for row in reversed(st))
+        if len(st) != len(st[0]):
+            return [st, rot2]
+        rot1 = tuple(zip(*reversed(st)))
+        rot3 = tuple(zip(*st))[::-1]
         return [st, rot1, rot2, rot3]
 
     def apply_all_symmetry_operations(st: State) -> List[State]:
         mir = get_vertical_mirror(st)
         return get_rotations(st) + get_rotations(mir)
 
-    all_symmetries = apply_all_symmetry_operations(st)
+    all_symmetries = apply_all_symmetry_operations(tuple(map(tuple, st)))
     duplicates_removed = list(dict.fromkeys(all_symmetries))
     return duplicates_removed
 
 
-def is_end(st: State) -> bool:
-    def are_same(triplet):
-        a, b, c = triplet
-        return a == b == c != 0
+def state_geometry(st: State, k: Optional[int] = None) -> Geometry:
+    # The geometry of a state's board; k defaults to the shorter side.
+    rows, cols = len(st), len(st[0])
+    return get_geometry(rows, cols, min(rows, cols) if k is None else k)
 
-    horizontals = [[st[ix][0], st[ix][1], st[ix][2]] for ix in range(3)]
-    verticals = [[st[0][ix], st[1][ix], st[2][ix]] for ix in range(3)]
-    diag1 = [st[0][0], st[1][1], st[2][2]]
-    diag2 = [st[2][0], st[1][1], st[0][2]]
-    lines = horizontals + verticals + [diag1, diag2]
 
-    return any(are_same(line) for line in lines)
+def is_end(st: State, k: Optional[int] = None) -> bool:
+    if k is None and len(st) == 3 and len(st[0]) == 3:
+        return is_won(encode_state(st))
+    geometry = state_geometry(st, k)
+    return geometry.is_won(geometry.encode_state(st))
 
 
 def make_move(st: State, row: int, col: int, val: int) -> State:
@@ -64,13 +82,13 @@ def make_move(st: State, row: int, col: int, val: int) -> State:
     return new_st
 
 
-def get_next_states_raw(st: State, step: int) -> List[State]:
+def get_next_states_raw(st: State, step: int, k: Optional[int] = None) -> List[State]:
     next_states = []
-    if is_end(st):
+    if is_end(st, k):
         return []
     new_val = step % 2 + 1
-    for row in range(3):
-        for col in range(3):
+    for row in range(len(st)):
+        for col in range(len(st[row])):
             val = st[row][col]
             if val == 0:
                 new_st = make_move(st, row, col, new_val)
@@ -78,48 +96,142 @@ def get_next_states_raw(st: State, step: int) -> List[State]:
     return next_states
 
 
-def add_symmetry_group(st: State, gid: GroupId) -> None:
-    global states, groups
-    assert gid not in groups
-    symmetry_group = get_symmetries(st)
-    groups[gid] = symmetry_group
-    states.update({st: gid for st in symmetry_group})
-
-
-def compute_and_queue_successors(nd: Node) -> None:
-    global groups, nodes, q, gid
-    sym_group = groups[nd.val]
-    canonical_state = sym_group[0]
-    next_states = get_next_states_raw(canonical_state, step)
-    for nxt_st in next_states:
-        if nxt_st in states:
-            gid_old = states[nxt_st]
-            if gid_old not in [suc.val for suc in nd.successors]:
-                nd.successors.append(nodes[gid_old])
-            continue
-        add_symmetry_group(nxt_st, gid)
-        new_nd = Node(gid)
-        nodes[gid] = new_nd
-        nd.successors.append(new_nd)
-        q.appendleft(new_nd)
+class StateGraph:
+    # The canonical state graph as flat arrays, row = group id (row 0 unused).
+    # codes: canonical bitboard of each group. The edges out of group g are
+    # offsets[g]:offsets[g + 1] in successors (the child's group id) and moves
+    # (the canonical square played), one per legal move in square order, so a
+    # child group can appear more than once. depth: stones on the board.
+    # outcome: the winning player, DRAW for a full board, ONGOING otherwise.
+    def __init__(self, codes: np.ndarray, offsets: np.ndarray, successors: np.ndarray, moves: np.ndarray,
+                 depth: np.ndarray, outcome: np.ndarray):
+        self.codes = codes
+        self.offsets = offsets
+        self.successors = successors
+        self.moves = moves
+        self.depth = depth
+        self.outcome = outcome
+        self.terminal = outcome != ONGOING
+        for array in (codes, offsets, successors, moves, depth, outcome, self.terminal):
+            array.setflags(write=False)
+
+    def __len__(self) -> int:
+        return len(self.codes) - 1
+
+    def children(self, gid: GroupId) -> Tuple[np.ndarray, np.ndarray]:
+        # (canonical squares, child group ids) of a group.
+        edges = slice(self.offsets[gid], self.offsets[gid + 1])
+        return self.moves[edges], self.successors[edges]
+
+    def edge_sources(self) -> np.ndarray:
+        # The group id each edge leaves from, aligned with successors.
+        return np.repeat(np.arange(len(self.codes), dtype=np.int32), np.diff(self.offsets))
+
+
+def build_state_graph() -> StateGraph:
+    # Breadth first from the empty board. Group ids are handed out in the
+    # order groups are first reached and a group's canonical board is the
+    # first of its symmetries to be reached, so ids are stable across runs.
+    codes = [EMPTY_BOARD, EMPTY_BOARD]
+    positions = {transform_board(EMPTY_BOARD, t): (ROOT, t) for t in range(N_SYMMETRIES)}
+    offsets = [0, 0]
+    successors = []
+    moves = []
+    outcome = [ONGOING]
+
+    gid = ROOT
+    while gid < len(codes):
+        board = codes[gid]
+        ply = bin(occupied_mask(board)).count('1')
+        if is_won(board):
+            outcome.append((ply - 1) % 2 + 1)
+        elif is_full(board):
+            outcome.append(DRAW)
+        else:
+            outcome.append(ONGOING)
+            for square in legal_moves(board):
+                child = apply_move(board, square, ply % 2 + 1)
+                position = positions.get(child)
+                if position is None:
+                    position = (len(codes), 0)
+                    for transform in range(N_SYMMETRIES):
+                        positions.setdefault(transform_board(child, transform), (len(codes), transform))
+                    codes.append(child)
+                successors.append(position[0])
+                moves.append(square)
+        offsets.append(len(successors))
         gid += 1
 
+    codes = np.array(codes, dtype=np.int64)
+    depth = np.array([bin(occupied_mask(board)).count('1') for board in codes.tolist()], dtype=np.int8)
+    depth[0] = -1
+    return StateGraph(codes, np.array(offsets, dtype=np.int32), np.array(successors, dtype=np.int32),
+                      np.array(moves, dtype=np.int8), depth, np.array(outcome, dtype=np.int8))
+
+
+def all_states_and_groups() -> Dict[State, GroupId]:
+    return dict(get_state_index().states)
+
+
+class StateIndex:
+    def __init__(self, graph: StateGraph):
+        self.graph = graph
+        groups = {}
+        board_positions = {}
+        for g, canonical_board in enumerate(graph.codes.tolist()[1:], start=1):
+            boards = [transform_board(canonical_board, transform) for transform in range(N_SYMMETRIES)]
+            groups[g] = tuple(dict.fromkeys(map(decode_board, boards)))
+            for transform, board in enumerate(boards):
+                board_positions.setdefault(board, (g, transform))
+        self.groups = MappingProxyType(groups)
+        self.canonical = MappingProxyType({g: sym_group[0] for g, sym_group in groups.items()})
+        self.states = MappingProxyType({st: g for g, sym_group in groups.items() for st in sym_group})
+        self.board_positions = MappingProxyType(board_positions)
+        self.positions = MappingProxyType({decode_board(b): pos for b, pos in board_positions.items()})
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def __contains__(self, st: State) -> bool:
+        return st in self.states
+
+    def group_id(self, st: State) -> GroupId:
+        return self.states[st]
+
+    def symmetries(self, st: State) -> SymmetryGroup:
+        return self.groups[self.states[st]]
+
+    def canonical_state(self, st: State) -> State:
+        return self.canonical[self.states[st]]
+
+    def canonicalize(self, st: State) -> Position:
+        return self.positions[st]
+
+    def canonicalize_board(self, board: Board) -> Position:
+        return self.board_positions[board]
+
+    def position(self, st) -> Position:
+        # Accepts a tuple state, any 3x3 nested sequence or array, or a bitboard.
+        if isinstance(st, Integral):
+            return self.board_positions[int(st)]
+        try:
+            return self.positions[st]
+        except (KeyError, TypeError):
+            return self.board_positions[encode_state(st)]
+
+
+_build_lock = threading.Lock()
+_state_index: Optional[StateIndex] = None
+
+
+def get_state_index() -> StateIndex:
+    global _state_index
+    if _state_index is None:
+        with _build_lock:
+            if _state_index is None:
+                _state_index = StateIndex(build_state_graph())
+    return _state_index
+
 
-def all_states_and_groups():
-    global states, groups, nodes, gid, q, step
-
-    empty_board_state = ((0, 0, 0), (0, 0, 0), (0, 0, 0))
-    states = {}
-    groups = {}
-    nodes = {}
-    gid = 1
-    add_symmetry_group(empty_board_state, gid)
-    root = Node(gid)
-    nodes[gid] = root
-    gid += 1
-    q = deque([root])
-
-    for step in range(11):
-        for _ in range(len(q)):
-            compute_and_queue_successors(q.pop())
-    return states
+def get_position(st) -> Position:
+    return get_state_index().position(st)
@@ -0,0 +1,88 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from menace import MenaceEngine
+from menace_qlearning import AfterstateEngine, QLearningEngine
+
+# File layout: a fixed header (magic, format version, array rank, up to two
+# dimensions, metadata length), UTF-8 JSON metadata describing the engine and
+# the array dtype, zero padding up to a 64-byte boundary, then the raw
+# C-ordered policy array, so that it can be memory-mapped in place.
+MAGIC = b'MENACECK'
+VERSION = 1
+_HEADER = struct.Struct('<8sHHQQI')
+_ALIGNMENT = 64
+
+ENGINE_KINDS = {'menace': MenaceEngine, 'qlearning': QLearningEngine, 'afterstate': AfterstateEngine}
+
+
+def save_policy(path, policy, metadata):
+    policy = np.ascontiguousarray(policy)
+    if policy.ndim > 2:
+        raise ValueError(f"Policies have at most 2 dimensions, got shape {policy.shape}")
+    metadata = {**metadata, 'dtype': np.lib.format.dtype_to_descr(policy.dtype)}
+    meta_bytes = json.dumps(metadata).encode()
+    shape = policy.shape + (0,) * (2 - policy.ndim)
+    header = _HEADER.pack(MAGIC, VERSION, policy.ndim, *shape, len(meta_bytes))
+    padding = -(len(header) + len(meta_bytes)) % _ALIGNMENT
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(meta_bytes)
+        f.write(b'\0' * padding)
+        f.write(policy.tobytes())
+    os.replace(tmp_path, path)
+
+
+def _read_header(f):
+    magic, version, ndim, dim0, dim1, meta_len = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{f.name} is not a MENACE checkpoint")
+    if version != VERSION:
+        raise ValueError(f"Unsupported checkpoint version {version} in {f.name}, expected {VERSION}")
+    metadata = json.loads(f.read(meta_len))
+    offset = _HEADER.size + meta_len
+    offset += -offset % _ALIGNMENT
+    return metadata, (dim0, dim1)[:ndim], offset
+
+
+def load_metadata(path):
+    with open(path, 'rb') as f:
+        return _read_header(f)[0]
+
+
+def load_policy(path, mmap_mode='r'):
+    # mmap_mode is passed to np.memmap: 'r' shares one read-only copy between
+    # processes, 'c' is copy-on-write (pages are only copied once written),
+    # None reads the array into memory.
+    with open(path, 'rb') as f:
+        metadata, shape, offset = _read_header(f)
+    dtype = np.lib.format.descr_to_dtype(metadata['dtype'])
+    if mmap_mode is None or not np.prod(shape):
+        policy = np.fromfile(path, dtype=dtype, offset=offset).reshape(shape)
+    else:
+        policy = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape)
+    return policy, metadata
+
+
+def save_engine(engine, path, **extra):
+    # extra is stored with the checkpoint, e.g. the number of games played so
+    # far when saving a training run for later resumption.
+    kinds = [kind for kind, cls in ENGINE_KINDS.items() if type(engine) is cls]
+    if not kinds:
+        raise ValueError(f"Cannot checkpoint a {type(engine).__name__}")
+    kind = kinds[0]
+    save_policy(path, engine.get_policy(), {'kind': kind, 'config': engine.get_config(), 'extra': extra})
+
+
+def load_engine(path, mmap_mode='c'):
+    policy, metadata = load_policy(path, mmap_mode)
+    engine = ENGINE_KINDS[metadata['kind']](**metadata['config'])
+    if mmap_mode == 'r':
+        engine.set_learning(False)
+    engine.set_policy(policy)
+    return engine
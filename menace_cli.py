@@ -0,0 +1,175 @@
+import argparse
+import functools
+import json
+import random
+import sys
+
+from menace import MenaceEngine, play_game
+from menace_checkpoint import load_engine, load_metadata, save_engine
+from menace_evaluation import evaluate as exact_evaluate
+from menace_exploration import Boltzmann, ExponentialEpsilon, LinearEpsilon
+from menace_game import HumanPlayer
+from menace_game import play_games as run_games
+from menace_metrics import METRICS
+from menace_offline import train_from_log
+from menace_records import GameLogWriter
+from menace_qlearning import AfterstateEngine, QLearningEngine
+
+print = functools.partial(print, flush=True)
+
+
+def make_engine(kind, name, args, seed):
+    if kind == 'menace':
+        return MenaceEngine(name=name, seed=seed)
+    cls = AfterstateEngine if kind == 'afterstate' else QLearningEngine
+    return cls(name=name, learning_rate=args.learning_rate, exploration_rate=args.exploration_rate,
+               trace_decay=args.trace_decay, exploration=make_cli_exploration(args), seed=seed)
+
+
+def make_cli_exploration(args):
+    decay = args.exploration_decay
+    if args.exploration == 'linear':
+        return LinearEpsilon(args.exploration_rate, args.exploration_end, int(decay or args.games))
+    if args.exploration == 'exponential':
+        return ExponentialEpsilon(args.exploration_rate, args.exploration_end, 1e-4 if decay is None else decay)
+    if args.exploration == 'boltzmann':
+        return Boltzmann(args.temperature, args.exploration_end, 1e-4 if decay is None else decay)
+    return None
+
+
+def play_games(engineA, engineB, n_games, batch_size, log=None):
+    # Returns engineA's (wins, draws, losses).
+    return run_games(engineA, engineB, n_games, batch_size=batch_size, rng=random.getrandbits(64), log=log)
+
+
+def evaluate(engineA, engineB, n_games, batch_size, exact=False):
+    # Returns engineA's (wins, draws, losses) as fractions of the games.
+    if exact:
+        return exact_evaluate(engineA, engineB)
+    learning = engineA.is_learning, engineB.is_learning
+    engineA.set_learning(False)
+    engineB.set_learning(False)
+    try:
+        wins, draws, losses = play_games(engineA, engineB, n_games, batch_size)
+        return wins / n_games, draws / n_games, losses / n_games
+    finally:
+        engineA.set_learning(learning[0])
+        engineB.set_learning(learning[1])
+
+
+def checkpoint_paths(prefix):
+    return f'{prefix}-A.ckpt', f'{prefix}-B.ckpt'
+
+
+def train_games(args, out, engineA, engineB, games, log):
+    # Trains for args.games more games, evaluating every args.eval_every games.
+    target = games + args.games
+    while games < target:
+        chunk = min(args.eval_every, target - games)
+        play_games(engineA, engineB, chunk, args.batch_size, log)
+        games += chunk
+        wins, draws, losses = evaluate(engineA, engineB, args.eval_games, args.batch_size, args.exact_eval)
+        record = {'games': games, 'wins': wins, 'draws': draws, 'losses': losses, 'draw_rate': draws}
+        if args.metrics:
+            record['metrics'] = METRICS.snapshot(A=engineA, B=engineB)
+        if out is not None:
+            out.write(json.dumps(record) + '\n')
+        if not args.quiet:
+            print(f"{games} games: {record['draw_rate'] * 100:.0f}% of games end in a draw.")
+    return games
+
+
+def train(args, out):
+    random.seed(args.seed)
+    METRICS.enable(args.metrics)
+    if args.resume:
+        pathA, pathB = checkpoint_paths(args.resume)
+        engineA, engineB = load_engine(pathA), load_engine(pathB)
+        engineA.set_seed(random.getrandbits(64))
+        engineB.set_seed(random.getrandbits(64))
+        games = load_metadata(pathA)['extra'].get('games', 0)
+    else:
+        engineA = make_engine(args.engine, f'{args.engine}A', args, random.getrandbits(64))
+        engineB = make_engine(args.engine, f'{args.engine}B', args, random.getrandbits(64))
+        games = 0
+
+    if args.train_from:
+        for engine in (engineA, engineB):
+            episodes = train_from_log(engine, args.train_from)
+            if not args.quiet:
+                print(f"Trained {engine.name} on {episodes} recorded episodes from {args.train_from}.")
+
+    log = GameLogWriter(args.record) if args.record else None
+    try:
+        games = train_games(args, out, engineA, engineB, games, log)
+    finally:
+        if log is not None:
+            log.close()
+
+    if args.save:
+        pathA, pathB = checkpoint_paths(args.save)
+        save_engine(engineA, pathA, games=games)
+        save_engine(engineB, pathB, games=games)
+
+    if args.show:
+        play_game(engineA, engineB, to_print=True)
+
+    if args.untrained:
+        untrained = make_engine(args.engine, f'untrained{args.engine}', args, random.getrandbits(64))
+        wins, draws, losses = evaluate(untrained, engineA, args.eval_games, args.batch_size, args.exact_eval)
+        print(f"The untrained engine wins {wins * 100:.0f}% of games and {draws * 100:.0f}% end in a draw.")
+
+    if args.human:
+        play_game(HumanPlayer('I, the player'), engineA, to_print=True)
+
+    return engineA, engineB
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Train and evaluate MENACE and Q-learning tic-tac-toe engines.")
+    parser.add_argument('--engine', choices=('menace', 'qlearning', 'afterstate'), default='menace')
+    parser.add_argument('--games', type=int, default=7100, help="number of training games")
+    parser.add_argument('--eval-every', type=int, default=1000, help="training games between evaluations")
+    parser.add_argument('--eval-games', type=int, default=100, help="games per evaluation")
+    parser.add_argument('--exact-eval', action='store_true',
+                        help="compute exact win/draw/loss probabilities instead of playing evaluation games")
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help="play games in lockstep batches of this size (0 plays them one at a time)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--learning-rate', type=float, default=0.01)
+    parser.add_argument('--exploration-rate', type=float, default=0.6, help="(initial) epsilon")
+    parser.add_argument('--exploration', choices=('constant', 'linear', 'exponential', 'boltzmann'),
+                        default='constant', help="Q-learning exploration schedule")
+    parser.add_argument('--exploration-end', type=float, default=0.05, help="final epsilon or temperature")
+    parser.add_argument('--exploration-decay', type=float, default=None,
+                        help="games to decay over (linear, default --games) or per-game decay rate "
+                             "(exponential, boltzmann, default 1e-4)")
+    parser.add_argument('--temperature', type=float, default=1.0, help="initial Boltzmann temperature")
+    parser.add_argument('--trace-decay', type=float, default=0.0, help="lambda for Q-learning TD(lambda)")
+    parser.add_argument('--output', help="write one JSON line per evaluation to this file ('-' for stdout)")
+    parser.add_argument('--save', metavar='PREFIX', help="save the trained engines to PREFIX-A.ckpt and PREFIX-B.ckpt")
+    parser.add_argument('--resume', metavar='PREFIX', help="continue training the engines saved under PREFIX")
+    parser.add_argument('--record', metavar='FILE', help="append every training game to this binary game log")
+    parser.add_argument('--train-from', metavar='FILE', help="train both engines on a game log before playing")
+    parser.add_argument('--show', action='store_true', help="print a game between the trained engines")
+    parser.add_argument('--untrained', action='store_true', help="evaluate an untrained engine against engine A")
+    parser.add_argument('--human', action='store_true', help="play a game against engine A after training")
+    parser.add_argument('--metrics', action='store_true',
+                        help="collect counters and timers and add a snapshot of them to each --output record")
+    parser.add_argument('--quiet', action='store_true')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.output is None:
+        train(args, None)
+    elif args.output == '-':
+        train(args, sys.stdout)
+    else:
+        with open(args.output, 'w') as out:
+            train(args, out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import numpy as np
+
+from menace_bitboard import TIC_TAC_TOE
+from menace_frozen import FrozenPolicy
+
+
+class Engine:
+    # What MenaceEngine and QLearningEngine share. play_many collects
+    # (games, state ids, moves) in batch_positions, which resolve_many hands
+    # to the subclass's learn_batch along with the results. freeze compiles
+    # the subclass's move_probabilities(): (n_groups + 1, 9), the
+    # probability of each canonical move per group.
+    geometry = TIC_TAC_TOE
+
+    def __init__(self, name):
+        self.name = name
+        self.is_learning = True
+        self.batch_positions = []
+
+    def resolve_many(self, results):
+        if self.is_learning and self.batch_positions:
+            self.learn_batch(*(np.concatenate(arrays) for arrays in zip(*self.batch_positions)), results)
+        self.batch_positions = []
+
+    def freeze(self, greedy=False, seed=None):
+        # An immutable inference-only copy of the current policy; greedy
+        # always plays the most likely move.
+        return FrozenPolicy(self.move_probabilities(), greedy).player(self.name, seed)
+
+    def set_learning(self, is_learning):
+        self.is_learning = is_learning
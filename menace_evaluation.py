@@ -0,0 +1,65 @@
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+
+from menace_bitboard import N_SQUARES
+from menace_board import DRAW, ROOT, get_state_index
+
+# Exact evaluation of two stochastic policies. Each policy is an
+# (n_groups + 1, 9) array holding, per canonical position, the probability of
+# each canonical move, as returned by an engine's move_probabilities(). The
+# probability of reaching each canonical position is pushed along the edges of
+# the state graph ply by ply, so the win/draw/loss probabilities come out exactly.
+
+
+def evaluate_policies(first: np.ndarray, second: np.ndarray) -> Tuple[float, float, float]:
+    # Exact (first player wins, draw, second player wins) probabilities.
+    first_wins, draws, second_wins = evaluate_policy_pairs(np.stack([first, second]), [0], [1])[0].tolist()
+    return first_wins, draws, second_wins
+
+
+@lru_cache(maxsize=None)
+def _ply_edges():
+    # Per ply: the parents, moves and successors of its edges, sorted by
+    # successor, and where each successor's run of edges starts.
+    graph = get_state_index().graph
+    sources = graph.edge_sources()
+    edge_depth = graph.depth[sources]
+    plies = []
+    for ply in range(N_SQUARES):
+        edges = np.flatnonzero(edge_depth == ply)
+        edges = edges[np.argsort(graph.successors[edges], kind='stable')]
+        successors, starts = np.unique(graph.successors[edges], return_index=True)
+        plies.append((sources[edges], graph.moves[edges], successors, starts))
+    return plies
+
+
+def evaluate_policy_pairs(policies: np.ndarray, first, second, chunk_size=1024) -> np.ndarray:
+    # evaluate_policies for many pairs at once: policies is a stack of
+    # (n_groups + 1, 9) arrays and pair i is policies[first[i]] against
+    # policies[second[i]]. Returns an (n_pairs, 3) array.
+    graph = get_state_index().graph
+    first, second = np.asarray(first, dtype=np.int64), np.asarray(second, dtype=np.int64)
+    plies = _ply_edges()
+    outcomes = [graph.outcome == outcome for outcome in (1, DRAW, 2)]
+    results = np.empty((len(first), 3))
+    for start in range(0, len(first), chunk_size):
+        movers = (first[start:start + chunk_size, None], second[start:start + chunk_size, None])
+        reach = np.zeros((len(movers[0]), len(graph.codes)))
+        reach[:, ROOT] = 1.0
+        for ply, (parents, moves, successors, starts) in enumerate(plies):
+            flow = reach[:, parents] * policies[movers[ply % 2], parents, moves]
+            reach[:, successors] += np.add.reduceat(flow, starts, axis=1)
+        results[start:start + chunk_size] = np.stack([reach[:, mask].sum(axis=1) for mask in outcomes], axis=1)
+    return results
+
+
+def evaluate(playerA, playerB) -> Tuple[float, float, float]:
+    # playerA's exact (win, draw, loss) probabilities when who moves first is
+    # decided by a fair coin, as in play_games.
+    probsA, probsB = playerA.move_probabilities(), playerB.move_probabilities()
+    a_wins, a_first_draws, b_wins = evaluate_policies(probsA, probsB)
+    b_first_wins, b_first_draws, a_second_wins = evaluate_policies(probsB, probsA)
+    return ((a_wins + a_second_wins) / 2, (a_first_draws + b_first_draws) / 2,
+            (b_wins + b_first_wins) / 2)
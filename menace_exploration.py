@@ -0,0 +1,119 @@
+import math
+
+import numpy as np
+
+# Exploration policies for QLearningEngine. Each picks a move from a row of
+# Q-values restricted to the legal squares, given how many episodes the engine
+# has learned from so far: choose_one for a single position, choose for a
+# batch of positions (one row per position). probabilities gives the exact
+# distribution that choose samples from, for exact policy evaluation.
+
+
+class EpsilonGreedy:
+    kind = 'constant'
+
+    def __init__(self, epsilon=0.8):
+        self.start = epsilon
+
+    def epsilon(self, episode):
+        return self.start
+
+    def choose_one(self, q_values, actions, rng, episode):
+        if rng.random() < self.epsilon(episode):
+            return int(actions[int(rng.random() * len(actions))])
+        return int(actions[q_values.argmax()])
+
+    def choose(self, q_values, legal, rng, episode):
+        greedy = np.where(legal, q_values, -np.inf).argmax(axis=1)
+        explore = np.where(legal, rng.random(legal.shape), -1.0).argmax(axis=1)
+        return np.where(rng.random(len(legal)) < self.epsilon(episode), explore, greedy)
+
+    def probabilities(self, q_values, legal, episode):
+        epsilon = self.epsilon(episode)
+        greedy = np.where(legal, q_values, -np.inf).argmax(axis=1)
+        probs = legal * (epsilon / np.maximum(legal.sum(axis=1, keepdims=True), 1))
+        probs[np.arange(len(legal)), greedy] += (1 - epsilon) * legal.any(axis=1)
+        return probs
+
+    def get_config(self):
+        return {'kind': self.kind, 'epsilon': self.start}
+
+
+class LinearEpsilon(EpsilonGreedy):
+    kind = 'linear'
+
+    def __init__(self, start=0.8, end=0.05, decay_games=10000):
+        super().__init__(start)
+        self.end = end
+        self.decay_games = decay_games
+
+    def epsilon(self, episode):
+        fraction = min(episode / self.decay_games, 1.0) if self.decay_games else 1.0
+        return self.start + (self.end - self.start) * fraction
+
+    def get_config(self):
+        return {'kind': self.kind, 'start': self.start, 'end': self.end, 'decay_games': self.decay_games}
+
+
+class ExponentialEpsilon(EpsilonGreedy):
+    kind = 'exponential'
+
+    def __init__(self, start=0.8, end=0.05, decay_rate=1e-4):
+        super().__init__(start)
+        self.end = end
+        self.decay_rate = decay_rate
+
+    def epsilon(self, episode):
+        return self.end + (self.start - self.end) * math.exp(-self.decay_rate * episode)
+
+    def get_config(self):
+        return {'kind': self.kind, 'start': self.start, 'end': self.end, 'decay_rate': self.decay_rate}
+
+
+class Boltzmann:
+    # Softmax over the legal moves' Q-values; the temperature decays
+    # exponentially from start to end.
+    kind = 'boltzmann'
+
+    def __init__(self, start=1.0, end=0.05, decay_rate=0.0):
+        self.start = start
+        self.end = end
+        self.decay_rate = decay_rate
+
+    def temperature(self, episode):
+        return self.end + (self.start - self.end) * math.exp(-self.decay_rate * episode)
+
+    def choose_one(self, q_values, actions, rng, episode):
+        weights = np.exp((q_values - q_values.max()) / self.temperature(episode))
+        cumulative = weights.cumsum()
+        return int(actions[min(np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right'),
+                               len(actions) - 1)])
+
+    def choose(self, q_values, legal, rng, episode):
+        logits = np.where(legal, q_values / self.temperature(episode), -np.inf)
+        weights = np.exp(logits - logits.max(axis=1, keepdims=True))
+        cumulative = weights.cumsum(axis=1)
+        draws = rng.random(len(legal)) * cumulative[:, -1]
+        return np.minimum((cumulative <= draws[:, None]).sum(axis=1), legal.shape[1] - 1)
+
+    def probabilities(self, q_values, legal, episode):
+        logits = np.where(legal, q_values / self.temperature(episode), -np.inf)
+        peaks = np.where(legal.any(axis=1), logits.max(axis=1), 0.0)
+        weights = np.exp(logits - peaks[:, None])
+        return weights / np.maximum(weights.sum(axis=1, keepdims=True), 1.0)
+
+    def get_config(self):
+        return {'kind': self.kind, 'start': self.start, 'end': self.end, 'decay_rate': self.decay_rate}
+
+
+EXPLORATION_KINDS = {cls.kind: cls for cls in (EpsilonGreedy, LinearEpsilon, ExponentialEpsilon, Boltzmann)}
+
+
+def make_exploration(spec):
+    # spec is a policy, a constant epsilon, or a get_config() dict.
+    if isinstance(spec, (int, float)):
+        return EpsilonGreedy(spec)
+    if isinstance(spec, dict):
+        config = dict(spec)
+        return EXPLORATION_KINDS[config.pop('kind')](**config)
+    return spec
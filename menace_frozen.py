@@ -0,0 +1,150 @@
+import random
+from functools import lru_cache
+from types import MappingProxyType
+
+import numpy as np
+
+from menace_batch import BOARD_SIZE, INVERSE_SYMMETRY_TABLE, SYMMETRY_TABLE
+from menace_bitboard import N_SQUARES, decode_board, encode_state
+from menace_board import get_state_index
+
+# Inference-only policies compiled from a trained engine. Every reachable
+# board gets a row of a Walker alias table over the actual (not canonical)
+# squares, so picking a move is one row lookup plus one uniform draw: pick a
+# column, keep it with probability prob[row, column], otherwise take
+# alias[row, column]. Greedy policies store the most likely move instead.
+
+
+def build_alias_table(probabilities):
+    # Vose's alias method, run on all rows at once: every step pairs one
+    # small column of each row with one large column, so n_columns - 1 steps
+    # finish every row. Rows that are all zero (finished games) are left as
+    # they are and never sampled.
+    n_rows, n_columns = probabilities.shape
+    prob = np.ones((n_rows, n_columns))
+    alias = np.tile(np.arange(n_columns, dtype=np.int8), (n_rows, 1))
+    totals = probabilities.sum(axis=1, keepdims=True)
+    scaled = np.divide(probabilities * n_columns, totals, out=np.zeros((n_rows, n_columns)), where=totals > 0)
+    done = np.zeros((n_rows, n_columns), dtype=bool)
+    for _ in range(n_columns - 1):
+        small = ~done & (scaled < 1.0)
+        large = ~done & (scaled >= 1.0)
+        rows = np.flatnonzero(small.any(axis=1) & large.any(axis=1))
+        if not len(rows):
+            break
+        less, more = small[rows].argmax(axis=1), large[rows].argmax(axis=1)
+        prob[rows, less] = scaled[rows, less]
+        alias[rows, less] = more
+        scaled[rows, more] -= 1.0 - scaled[rows, less]
+        done[rows, less] = True
+    # Whatever is left is 1 up to rounding error.
+    prob[~done] = 1.0
+    return prob, alias
+
+
+@lru_cache(maxsize=None)
+def _board_layout():
+    # (canonical gids, transforms, bitboard -> row, board state -> row) for
+    # the rows of every reachable board; the same for every policy.
+    state_index = get_state_index()
+    boards = np.array(sorted(state_index.board_positions), dtype=np.int64)
+    gids, transforms = np.array([state_index.board_positions[board] for board in boards.tolist()]).T
+    board_rows = np.full(BOARD_SIZE, -1, dtype=np.int16)
+    board_rows[boards] = np.arange(len(boards))
+    for array in (gids, transforms, board_rows):
+        array.setflags(write=False)
+    rows = MappingProxyType({decode_board(board): row for row, board in enumerate(boards.tolist())})
+    return gids, transforms, board_rows, rows
+
+
+class FrozenPolicy:
+    # Immutable, so one policy can serve any number of threads; each thread
+    # or game should play through its own FrozenPlayer for its own random
+    # numbers.
+    def __init__(self, canonical_probabilities, greedy=False):
+        gids, transforms, self.board_rows, self.rows = _board_layout()
+        # The actual square s of a board is square SYMMETRIES[t][s] of its
+        # canonical state.
+        squares = SYMMETRY_TABLE[transforms]
+
+        self.greedy = greedy
+        self.canonical_probabilities = np.array(canonical_probabilities, dtype=float)
+        self.canonical_best_moves = self.canonical_probabilities.argmax(axis=1)
+        self.best_moves = INVERSE_SYMMETRY_TABLE[transforms, self.canonical_best_moves[gids]].astype(np.int8)
+        # Every board's row is its canonical state's row with the columns
+        # permuted, so only the canonical rows go through Vose's method.
+        canonical_prob, canonical_alias = build_alias_table(self.canonical_probabilities)
+        self.prob = canonical_prob[gids[:, None], squares]
+        aliases = canonical_alias[gids[:, None], squares]
+        self.alias = INVERSE_SYMMETRY_TABLE[transforms[:, None], aliases].astype(np.int8)
+        for array in (self.canonical_probabilities, self.canonical_best_moves, self.best_moves, self.prob, self.alias):
+            array.setflags(write=False)
+        # Plain lists for the single-move path, which is faster than indexing
+        # numpy arrays one element at a time.
+        self._prob = self.prob.tolist()
+        self._alias = self.alias.tolist()
+        self._best_moves = self.best_moves.tolist()
+
+    def move(self, board_state, uniform):
+        # The move for a state, given a uniform random number in [0, 1).
+        try:
+            row = self.rows[board_state]
+        except (KeyError, TypeError):
+            row = self.board_rows[encode_state(board_state)]
+            if row < 0:
+                raise ValueError(f"Board state {board_state} is not among the reachable states") from None
+        if self.greedy:
+            return self._best_moves[row]
+        scaled = uniform * N_SQUARES
+        column = int(scaled)
+        return column if scaled - column < self._prob[row][column] else self._alias[row][column]
+
+    def moves(self, boards, uniforms):
+        # Vectorized move() for an array of bitboards.
+        rows = self.board_rows[boards]
+        if rows.min(initial=0) < 0:
+            board = decode_board(int(boards[np.argmin(rows)]))
+            raise ValueError(f"Board state {board} is not among the reachable states")
+        if self.greedy:
+            return self.best_moves[rows]
+        scaled = uniforms * N_SQUARES
+        columns = scaled.astype(np.int64)
+        return np.where(scaled - columns < self.prob[rows, columns], columns, self.alias[rows, columns])
+
+    def player(self, name, seed=None):
+        return FrozenPlayer(self, name, seed)
+
+
+class FrozenPlayer:
+    # Plays a FrozenPolicy and never learns.
+    def __init__(self, policy, name, seed=None):
+        self.policy = policy
+        self.name = name
+        self.is_learning = False
+        self.set_seed(seed)
+
+    def play(self, board_state):
+        return self.policy.move(board_state, self.random())
+
+    def play_many(self, boards, games):
+        return self.policy.moves(boards, self.rng.random(len(boards)))
+
+    def move_probabilities(self):
+        policy = self.policy
+        if not policy.greedy:
+            return policy.canonical_probabilities
+        has_moves = policy.canonical_probabilities.any(axis=1, keepdims=True)
+        return np.eye(N_SQUARES)[policy.canonical_best_moves] * has_moves
+
+    def resolve_game(self, result):
+        pass
+
+    def resolve_many(self, results):
+        pass
+
+    def set_learning(self, is_learning):
+        pass
+
+    def set_seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(int(self.rng.integers(1 << 63))).random
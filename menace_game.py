@@ -0,0 +1,234 @@
+from time import perf_counter
+from typing import Optional, Protocol, Sequence
+
+import numpy as np
+
+from menace_batch import game_geometry, simulate
+from menace_bitboard import EMPTY_BOARD, TIC_TAC_TOE, Board, Geometry, Square
+from menace_board import State, print_state
+from menace_metrics import METRICS
+
+DRAW = 0
+
+
+class Player(Protocol):
+    # What the game loop needs from a player. Results are 'W', 'L' or 'D'
+    # from the player's own point of view. Players that also implement
+    # play_many(boards, games) and resolve_many(results) can be run in
+    # lockstep batches by menace_batch.
+    name: str
+
+    def play(self, board_state: State) -> Square:
+        ...
+
+    def resolve_game(self, result: str) -> None:
+        ...
+
+
+class GameBoard:
+    # A mutable board that keeps its moves on a stack, so moves can be made
+    # and undone in place. Player 1 moves on even plies, player 2 on odd ones.
+    __slots__ = ('bits', 'moves', 'geometry')
+
+    def __init__(self, bits: Board = EMPTY_BOARD, moves: Sequence[Square] = (), geometry: Geometry = TIC_TAC_TOE):
+        self.bits = bits
+        self.moves = list(moves)
+        self.geometry = geometry
+
+    @property
+    def player(self) -> int:
+        return len(self.moves) % 2 + 1
+
+    @property
+    def state(self) -> State:
+        return self.geometry.decode_board(self.bits)
+
+    def is_legal(self, square: Square) -> bool:
+        n_squares = self.geometry.n_squares
+        return 0 <= square < n_squares and not (self.bits | self.bits >> n_squares) >> square & 1
+
+    def legal_moves(self):
+        return self.geometry.legal_moves(self.bits)
+
+    def make_move(self, square: Square) -> None:
+        if not self.is_legal(square):
+            raise ValueError(f"Illegal move {square!r} on\n{self.state}")
+        self.bits |= self.geometry.move_bits[len(self.moves) % 2 + 1][square]
+        self.moves.append(square)
+
+    def undo_move(self) -> Square:
+        square = self.moves.pop()
+        self.bits &= ~self.geometry.move_bits[len(self.moves) % 2 + 1][square]
+        return square
+
+    def has_won(self, player: int) -> bool:
+        return self.geometry.has_won(self.bits, player)
+
+    def is_full(self) -> bool:
+        return len(self.moves) == self.geometry.n_squares
+
+
+class GameHooks:
+    # Per-ply callbacks for run_game. Subclass and override what you need;
+    # passing hooks=None skips them entirely.
+    def on_game_start(self, player1: Player, player2: Player, board: GameBoard) -> None:
+        pass
+
+    def on_move(self, player: Player, square: Square, board: GameBoard) -> None:
+        pass
+
+    def on_game_end(self, winner: int, player1: Player, player2: Player, board: GameBoard) -> None:
+        pass
+
+
+class HookList(GameHooks):
+    # Calls several hooks in turn, skipping any that are None.
+    def __init__(self, *hooks: Optional[GameHooks]):
+        self.hooks = [hook for hook in hooks if hook is not None]
+
+    def on_game_start(self, player1, player2, board):
+        for hook in self.hooks:
+            hook.on_game_start(player1, player2, board)
+
+    def on_move(self, player, square, board):
+        for hook in self.hooks:
+            hook.on_move(player, square, board)
+
+    def on_game_end(self, winner, player1, player2, board):
+        for hook in self.hooks:
+            hook.on_game_end(winner, player1, player2, board)
+
+
+def make_hooks(*hooks: Optional[GameHooks]) -> Optional[GameHooks]:
+    # None if every hook is None, so run_game can skip them entirely.
+    hooks = [hook for hook in hooks if hook is not None]
+    if not hooks:
+        return None
+    return hooks[0] if len(hooks) == 1 else HookList(*hooks)
+
+
+class PrintHooks(GameHooks):
+    def on_game_start(self, player1, player2, board):
+        print(f"Player 1: {player1.name} vs. Player 2: {player2.name}")
+        print("Turn 0")
+        print_state(board.state)
+        print('\n')
+
+    def on_move(self, player, square, board):
+        print(f"Turn {len(board.moves)}, {player.name}")
+        print_state(board.state)
+        print('\n')
+
+    def on_game_end(self, winner, player1, player2, board):
+        if winner == DRAW:
+            print("The game is a draw!")
+        else:
+            print(f"{(player1, player2)[winner - 1].name} wins!")
+
+
+class HumanPlayer:
+    # Plays on whatever board it is shown.
+    geometry = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def play(self, board_state):
+        n_rows, n_cols = len(board_state), len(board_state[0])
+        while True:
+            print(f"Enter a position (0-{n_rows * n_cols - 1}):")
+            try:
+                position = int(input())
+            except ValueError:
+                continue
+            row, col = divmod(position, n_cols)
+            if 0 <= position < n_rows * n_cols and board_state[row][col] == 0:
+                return position
+            print(f"Position {position} is not free.")
+
+    def resolve_game(self, result):
+        pass
+
+
+def run_game(player1: Player, player2: Player, hooks: Optional[GameHooks] = None,
+             geometry: Optional[Geometry] = None) -> int:
+    # Plays one game with player1 moving first and lets both players learn
+    # from it. Returns the winning player (1 or 2) or DRAW. The board is the
+    # players' own, see menace_batch.game_geometry.
+    geometry = game_geometry(player1, player2, geometry)
+    board = GameBoard(geometry=geometry)
+    players = (player1, player2)
+    winner = DRAW
+    timed = METRICS.enabled
+    if hooks is not None:
+        hooks.on_game_start(player1, player2, board)
+
+    for ply in range(geometry.n_squares):
+        player = players[ply & 1]
+        if timed:
+            start = perf_counter()
+        square = player.play(board.state)
+        if timed:
+            moved = perf_counter()
+            METRICS.add_time('game.move_selection', moved - start)
+        board.make_move(square)
+        if timed:
+            METRICS.add_time('game.board_update', perf_counter() - moved)
+        if hooks is not None:
+            hooks.on_move(player, square, board)
+        if timed:
+            start = perf_counter()
+        won = board.has_won((ply & 1) + 1)
+        if timed:
+            METRICS.add_time('game.terminal_check', perf_counter() - start)
+        if won:
+            winner = (ply & 1) + 1
+            break
+
+    if timed:
+        start = perf_counter()
+    if winner == 1:
+        player1.resolve_game('W')
+        player2.resolve_game('L')
+    elif winner == 2:
+        player1.resolve_game('L')
+        player2.resolve_game('W')
+    else:
+        player1.resolve_game('D')
+        player2.resolve_game('D')
+    if timed:
+        METRICS.add_time('game.learning_update', perf_counter() - start)
+        METRICS.count('game.games')
+        METRICS.count(f'game.results.{winner}')
+
+    if hooks is not None:
+        hooks.on_game_end(winner, player1, player2, board)
+    return winner
+
+
+def supports_batch(player) -> bool:
+    return hasattr(player, 'play_many') and hasattr(player, 'resolve_many')
+
+
+def play_games(playerA, playerB, n_games, batch_size=10000, rng=None, log=None, geometry=None):
+    # Returns playerA's (wins, draws, losses). Who moves first is random per
+    # game. Players that support it are run in lockstep batches. Every game
+    # is written to log (a menace_records.GameLogWriter) if one is given;
+    # logs only hold 3x3 games.
+    geometry = game_geometry(playerA, playerB, geometry)
+    if log is not None and geometry != TIC_TAC_TOE:
+        raise ValueError(f"Game logs only hold 3x3 games, not {geometry}")
+    if batch_size and supports_batch(playerA) and supports_batch(playerB):
+        return simulate(playerA, playerB, n_games, batch_size=batch_size, rng=rng, log=log, geometry=geometry)
+
+    rng = np.random.default_rng(rng)
+    counts = [0, 0, 0]
+    for a_first in (rng.random(n_games) < 0.5).tolist():
+        if a_first:
+            winner = run_game(playerA, playerB, log, geometry)
+            counts[(1, 0, 2)[winner]] += 1
+        else:
+            winner = run_game(playerB, playerA, log, geometry)
+            counts[(1, 2, 0)[winner]] += 1
+    wins, draws, losses = counts
+    return wins, draws, losses
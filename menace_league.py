@@ -0,0 +1,201 @@
+import itertools
+import multiprocessing
+import os
+
+import numpy as np
+
+from menace_batch import simulate
+from menace_evaluation import evaluate_policy_pairs
+from menace_frozen import FrozenPolicy
+
+# A population of engines rated by Elo. Matches are scored exactly from the
+# engines' move distributions (menace_evaluation), many pairs at a time, so a
+# match costs a fraction of a millisecond whatever its "length"; a round can
+# be spread over a process pool.
+
+
+class Snapshot:
+    # A read-only copy of an engine's policy, kept as its move distribution
+    # only: no boxes, Q-table, trajectories or learning state. Snapshots of an
+    # engine that has not changed in between share one array.
+    def __init__(self, name, probabilities):
+        self.name = name
+        self.probabilities = probabilities
+        self.is_learning = False
+        self._player = None
+
+    def move_probabilities(self):
+        return self.probabilities
+
+    def player(self, seed=None):
+        # Compiled on first use, for playing actual games against it.
+        if self._player is None:
+            self._player = FrozenPolicy(self.probabilities).player(self.name, seed)
+        return self._player
+
+
+class Entry:
+    def __init__(self, player, rating, parent=None):
+        self.player = player
+        self.rating = rating
+        self.matches = 0
+        self.parent = parent
+
+    @property
+    def name(self):
+        return self.player.name
+
+
+def clone_engine(engine, name, **overrides):
+    # A new engine with engine's configuration, except for overrides, and a
+    # copy of its policy.
+    config = {**engine.get_config(), 'name': name, **overrides}
+    clone = type(engine)(**config)
+    clone.set_policy(np.array(engine.get_policy(), copy=True))
+    return clone
+
+
+def expected_score(rating, opponent_rating):
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+
+def _score_matches(task):
+    # Expected score of the first engine of each pair, a win counting 1 and a
+    # draw 1/2, with who moves first decided by a coin.
+    policies, first, second = task
+    a_first = evaluate_policy_pairs(policies, first, second)
+    b_first = evaluate_policy_pairs(policies, second, first)
+    return (a_first[:, 0] + b_first[:, 2]) / 2 + (a_first[:, 1] + b_first[:, 1]) / 4
+
+
+class League:
+    def __init__(self, k_factor=16.0, initial_rating=1200.0, n_workers=0, seed=None, mp_context=None):
+        # n_workers=None uses every CPU, 0 scores matches in this process.
+        self.k_factor = k_factor
+        self.initial_rating = initial_rating
+        self.entries = {}
+        self.rng = np.random.default_rng(seed)
+        self.n_workers = os.cpu_count() if n_workers is None else n_workers
+        self.pool = multiprocessing.get_context(mp_context).Pool(self.n_workers) if self.n_workers else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, player, rating=None, parent=None):
+        if player.name in self.entries:
+            raise ValueError(f"The league already has an engine named {player.name!r}")
+        entry = Entry(player, self.initial_rating if rating is None else rating, parent)
+        self.entries[player.name] = entry
+        return entry
+
+    def snapshot(self, name, snapshot_name=None):
+        # Adds a frozen copy of an engine at its current rating.
+        entry = self.entries[name]
+        probabilities = np.asarray(entry.player.move_probabilities(), dtype=np.float32)
+        for other in self.entries.values():
+            if other.parent == name and isinstance(other.player, Snapshot) \
+                    and np.array_equal(other.player.probabilities, probabilities):
+                probabilities = other.player.probabilities
+                break
+        else:
+            probabilities.setflags(write=False)
+        snapshot_name = snapshot_name or f"{name}@{entry.matches}"
+        return self.add(Snapshot(snapshot_name, probabilities), entry.rating, parent=name)
+
+    def clone(self, name, clone_name, **overrides):
+        # Adds a trainable copy of an engine, e.g. with other hyperparameters.
+        entry = self.entries[name]
+        return self.add(clone_engine(entry.player, clone_name, **overrides), entry.rating, parent=name)
+
+    def remove(self, name):
+        del self.entries[name]
+
+    def round_robin(self):
+        return list(itertools.combinations(self.entries, 2))
+
+    def swiss(self):
+        # Pairs neighbours in the standings; with an odd number of engines
+        # the lowest rated sits out.
+        names = [entry.name for entry in self.standings()]
+        return list(zip(names[0::2], names[1::2]))
+
+    def score_matches(self, pairs):
+        names = list(self.entries)
+        numbers = {name: number for number, name in enumerate(names)}
+        policies = np.stack([self.entries[name].player.move_probabilities() for name in names]).astype(float)
+        first = np.array([numbers[a] for a, _ in pairs], dtype=np.int64)
+        second = np.array([numbers[b] for _, b in pairs], dtype=np.int64)
+        if self.pool is None or len(pairs) < 2 * self.n_workers:
+            return _score_matches((policies, first, second)).tolist()
+        # One task per worker, so the policies are sent to each worker once.
+        tasks = [(policies, a, b) for a, b in zip(np.array_split(first, self.n_workers),
+                                                   np.array_split(second, self.n_workers))]
+        return np.concatenate(self.pool.map(_score_matches, tasks)).tolist()
+
+    def play_round(self, schedule='round_robin'):
+        # Scores every match of the round from the ratings before the round,
+        # then applies all the rating changes, so the order of matches does
+        # not matter. Returns {(a, b): a's expected score}.
+        pairs = self.round_robin() if schedule == 'round_robin' else self.swiss()
+        scores = self.score_matches(pairs)
+        changes = dict.fromkeys(self.entries, 0.0)
+        for (a, b), score in zip(pairs, scores):
+            delta = self.k_factor * (score - expected_score(self.entries[a].rating, self.entries[b].rating))
+            changes[a] += delta
+            changes[b] -= delta
+        for name, change in changes.items():
+            self.entries[name].rating += change
+        for a, b in pairs:
+            self.entries[a].matches += 1
+            self.entries[b].matches += 1
+        return dict(zip(pairs, scores))
+
+    def train(self, n_games, batch_size=10000):
+        # Every learning engine plays n_games against an opponent drawn from
+        # the rest of the league, or against a frozen copy of itself if it is
+        # alone; the opponents do not learn from these games.
+        names = list(self.entries)
+        for entry in list(self.entries.values()):
+            if not entry.player.is_learning:
+                continue
+            others = [name for name in names if name != entry.name]
+            if not others:
+                opponent = entry.player.freeze(seed=self.rng.integers(1 << 63))
+            else:
+                opponent = self.entries[others[self.rng.integers(len(others))]].player
+            if isinstance(opponent, Snapshot):
+                opponent = opponent.player(self.rng.integers(1 << 63))
+            learning = opponent.is_learning
+            opponent.set_learning(False)
+            try:
+                simulate(entry.player, opponent, n_games, batch_size=batch_size, rng=self.rng)
+            finally:
+                opponent.set_learning(learning)
+
+    def exploit_explore(self, fraction=0.25, perturb=None):
+        # Population-based training step: each of the worst rated learning
+        # engines is replaced by a clone of one of the best, with
+        # hyperparameters from perturb(config, rng), if given.
+        learners = [entry for entry in self.standings() if entry.player.is_learning]
+        n = int(len(learners) * fraction)
+        replaced = []
+        for loser, winner in zip(learners[::-1][:n], learners[:n]):
+            overrides = perturb(winner.player.get_config(), self.rng) if perturb else {}
+            self.remove(loser.name)
+            replaced.append(self.clone(winner.name, loser.name, **overrides))
+        return replaced
+
+    def standings(self):
+        return sorted(self.entries.values(), key=lambda entry: entry.rating, reverse=True)
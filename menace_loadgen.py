@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import functools
+import json
+import random
+import time
+
+import numpy as np
+
+from menace import MenaceEngine
+from menace_checkpoint import load_engine
+from menace_server import GameServer, start_server
+
+print = functools.partial(print, flush=True)
+
+# Load generator for menace_server: many concurrent clients, each playing
+# random legal moves over its own connection, timing every request.
+
+
+async def client(connect, n_games, latencies, results, rng):
+    reader, writer = await connect()
+    try:
+        for _ in range(n_games):
+            request = f"NEW {rng.choice('XO')}\n"
+            while True:
+                start = time.perf_counter()
+                writer.write(request.encode())
+                await writer.drain()
+                reply = (await reader.readline()).decode().split()
+                latencies.append(time.perf_counter() - start)
+                if reply[0] != 'BOARD':
+                    raise RuntimeError(f"Server replied {' '.join(reply)!r} to {request.strip()!r}")
+                _, _, cells, status = reply
+                if status != 'PLAY':
+                    results[status] += 1
+                    break
+                request = f"MOVE {rng.choice([i for i, cell in enumerate(cells) if cell == '0'])}\n"
+        writer.write(b"QUIT\n")
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def run_load(connect, n_clients, games_per_client, seed=None):
+    # Returns games/second, requests/second and latency percentiles in ms.
+    rng = random.Random(seed)
+    latencies = []
+    results = {'WIN': 0, 'DRAW': 0, 'LOSS': 0}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(connect, games_per_client, latencies, results, random.Random(rng.getrandbits(64)))
+                           for _ in range(n_clients)))
+    elapsed = time.perf_counter() - start
+    games = n_clients * games_per_client
+    percentiles = np.percentile(np.array(latencies) * 1000, [50, 90, 99, 100]).tolist()
+    return {'clients': n_clients, 'games': games, 'seconds': elapsed, 'games_per_second': games / elapsed,
+            'requests_per_second': len(latencies) / elapsed,
+            'latency_ms': dict(zip(('p50', 'p90', 'p99', 'max'), percentiles)), 'client_results': results}
+
+
+async def main_async(args):
+    server = listener = None
+    if args.local:
+        engine = load_engine(args.checkpoint) if args.checkpoint else MenaceEngine('server', seed=args.seed)
+        server = GameServer(engine, learn=args.learn, max_batch=args.max_batch, seed=args.seed)
+        listener = await start_server(server, unix_path=args.unix)
+        if args.unix is None:
+            args.port = listener.sockets[0].getsockname()[1]
+
+    if args.unix:
+        connect = functools.partial(asyncio.open_unix_connection, args.unix)
+    else:
+        connect = functools.partial(asyncio.open_connection, args.host, args.port)
+    report = await run_load(connect, args.clients, args.games, args.seed)
+
+    if server is not None:
+        report['server'] = server.stats()
+        listener.close()
+        await listener.wait_closed()
+        await server.stop()
+    print(json.dumps(report, indent=2))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Measure latency and throughput of a menace_server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH', help="connect over a Unix socket instead of TCP")
+    parser.add_argument('--clients', type=int, default=100, help="concurrent connections")
+    parser.add_argument('--games', type=int, default=10, help="games per connection")
+    parser.add_argument('--local', action='store_true', help="start a server in this process instead of connecting "
+                                                              "to a running one")
+    parser.add_argument('--checkpoint', help="with --local, the engine checkpoint to serve")
+    parser.add_argument('--learn', action='store_true', help="with --local, let the server learn from the games")
+    parser.add_argument('--max-batch', type=int, default=1024, help="with --local, the server's move batch size")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser
+
+
+def main(argv=None):
+    asyncio.run(main_async(build_parser().parse_args(argv)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Process-wide counters and timers, off by default. Hot paths test
+# METRICS.enabled before doing any work, so leaving the calls in costs one
+# attribute lookup when metrics are off.
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(lambda: [0.0, 0])
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def add_time(self, name, seconds, calls=1):
+        timer = self.timers[name]
+        timer[0] += seconds
+        timer[1] += calls
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def snapshot(self, **engines):
+        # engines are reported through their stats() method, keyed by name.
+        snapshot = {'counters': dict(self.counters),
+                    'timers': {name: {'seconds': seconds, 'calls': calls, 'mean': seconds / calls if calls else 0.0}
+                               for name, (seconds, calls) in self.timers.items()}}
+        if engines:
+            snapshot['engines'] = {name: engine.stats() for name, engine in engines.items()}
+        return snapshot
+
+
+METRICS = Metrics()
@@ -0,0 +1,272 @@
+import numpy as np
+
+from menace import MatchBoxes, MenaceEngine
+from menace_batch import get_board_arrays
+from menace_bitboard import Geometry, get_geometry
+from menace_qlearning import QLearningEngine
+
+# MENACE and Q-learning on m,n,k boards (for example 4x4 with 4 in a row),
+# where the reachable positions can no longer be enumerated up front. A box
+# or Q-table row is created the first time its canonical position is seen.
+# The tables are allocated once, for at most max_positions positions, with
+# np.zeros, so memory is only committed as rows are used.
+
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# Row of positions seen after the table filled up. It is never learned and
+# has no legal moves, so Q-learning also uses it as the terminal row.
+OVERFLOW = 0
+
+
+def as_geometry(spec):
+    # A Geometry, or its (rows, cols, k) config.
+    return spec if isinstance(spec, Geometry) else get_geometry(*spec)
+
+
+class PositionTable:
+    # Row numbers for canonical boards, handed out the first time each board
+    # is looked up. An open-addressing hash table kept in numpy arrays, so a
+    # whole batch of boards is probed at once; it doubles whenever it gets
+    # half full. Rows start at 1.
+    def __init__(self, arrays, max_positions=1 << 21):
+        self.arrays = arrays
+        self.max_positions = max_positions
+        self.codes = np.zeros(max_positions + 1, dtype=np.int64)
+        self.legal = np.zeros((max_positions + 1, arrays.n_squares), dtype=bool)
+        self.size = 0
+        self.overflows = 0
+        self.resize(1 << 12)
+
+    def __len__(self):
+        return self.size
+
+    def resize(self, n_slots):
+        # keys holds board + 1, so 0 marks a free slot.
+        self.keys = np.zeros(n_slots, dtype=np.int64)
+        self.slot_rows = np.zeros(n_slots, dtype=np.int32)
+        self.slot_mask = n_slots - 1
+        self.hash_shift = np.uint64(64 - (n_slots.bit_length() - 1))
+        if self.size:
+            rows = np.arange(1, self.size + 1)
+            pending, slots = self.probe(self.codes[rows] + 1)
+            while len(pending):
+                claims = self.claim(slots, self.codes[rows[pending]] + 1)
+                self.slot_rows[slots[claims]] = rows[pending[claims]]
+                pending, slots = self.advance(pending, slots, claims)
+
+    def probe(self, keys):
+        # (indices into keys, their first slots).
+        return np.arange(len(keys)), (keys.astype(np.uint64) * _HASH_MULTIPLIER >> self.hash_shift).astype(np.int64)
+
+    def claim(self, slots, keys, limit=None):
+        # Stores keys[i] in slots[i] where that slot is free, at most limit of
+        # them; of several keys after the same slot the first one gets it.
+        # Returns the indices of the keys stored.
+        free = np.flatnonzero(self.keys[slots] == 0)
+        _, first = np.unique(slots[free], return_index=True)
+        claims = free[first][:limit]
+        self.keys[slots[claims]] = keys[claims]
+        return claims
+
+    def advance(self, pending, slots, done):
+        keep = np.ones(len(pending), dtype=bool)
+        keep[done] = False
+        return pending[keep], (slots[keep] + 1) & self.slot_mask
+
+    def lookup(self, codes):
+        # (rows of the canonical boards, rows added by this call). Boards seen
+        # after max_positions boards get OVERFLOW.
+        keys, inverse = np.unique(codes, return_inverse=True)
+        keys += 1
+        if 2 * (self.size + len(keys)) > len(self.keys):
+            self.resize(1 << (2 * min(self.size + len(keys), self.max_positions)).bit_length())
+        rows = np.zeros(len(keys), dtype=np.int64)
+        added = []
+        pending, slots = self.probe(keys)
+        while len(pending):
+            slot_keys = self.keys[slots]
+            hit = np.flatnonzero(slot_keys == keys[pending])
+            rows[pending[hit]] = self.slot_rows[slots[hit]]
+            done = [hit]
+            if (slot_keys == 0).any():
+                room = self.max_positions - self.size
+                if room:
+                    claims = self.claim(slots, keys[pending], room)
+                    new_rows = np.arange(self.size + 1, self.size + 1 + len(claims))
+                    self.slot_rows[slots[claims]] = new_rows
+                    self.codes[new_rows] = keys[pending[claims]] - 1
+                    self.legal[new_rows] = self.arrays.legal_move_masks(self.codes[new_rows])
+                    self.size += len(claims)
+                    rows[pending[claims]] = new_rows
+                    added.append(new_rows)
+                    done.append(claims)
+                else:
+                    overflow = np.flatnonzero(slot_keys == 0)
+                    self.overflows += len(overflow)
+                    done.append(overflow)
+            pending, slots = self.advance(pending, slots, np.concatenate(done))
+        added = np.concatenate(added) if added else np.zeros(0, dtype=np.int64)
+        return rows[inverse.reshape(-1)], added
+
+    def stats(self):
+        return {'positions': self.size, 'max_positions': self.max_positions, 'overflow_lookups': self.overflows,
+                'hash_slots': len(self.keys)}
+
+
+class LazyMatchBoxes(MatchBoxes):
+    # MatchBoxes whose boxes are filled with start_tokens beads per legal
+    # square the first time their position is looked up.
+    def __init__(self, table, start_tokens=3, min_beads=0, refill='reset', dtype=np.int32, seed=None):
+        self.table = table
+        super().__init__(start_tokens, min_beads, refill, dtype, seed, legal=table.legal)
+
+    def __len__(self):
+        return len(self.table)
+
+    def set_box_values(self):
+        used = slice(0, self.table.size + 1)
+        self.beads[used] = self.legal[used] * self.start_tokens
+
+    def positions(self, codes):
+        rows, added = self.table.lookup(codes)
+        if len(added):
+            self.beads[added] = self.legal[added] * self.start_tokens
+        return rows
+
+    def sample_codes(self, codes):
+        # (box numbers, canonical squares) for canonical boards. Positions
+        # without a box of their own are played uniformly at random.
+        rows = self.positions(codes)
+        counts = self.beads[rows]
+        overflow = rows == OVERFLOW
+        if overflow.any():
+            counts[overflow] = self.table.arrays.legal_move_masks(codes[overflow])
+        return rows, self.sample_counts(counts, rows)
+
+    def add_beads(self, box_number, position, amount):
+        if box_number != OVERFLOW:
+            super().add_beads(box_number, position, amount)
+
+    def add_beads_many(self, box_numbers, positions, amounts):
+        keep = np.asarray(box_numbers) != OVERFLOW
+        amounts = np.broadcast_to(amounts, keep.shape)
+        super().add_beads_many(np.asarray(box_numbers)[keep], np.asarray(positions)[keep], amounts[keep])
+
+    def stats(self):
+        totals = self.beads[1:self.table.size + 1][self.legal[1:self.table.size + 1].any(axis=1)].sum(axis=1)
+        percentiles = np.percentile(totals, [0, 25, 50, 75, 100]).tolist() if len(totals) else [0.0] * 5
+        return {**self.table.stats(), 'boxes': len(totals), 'beads': int(totals.sum()),
+                'empty_boxes': int((totals == 0).sum()),
+                'beads_per_box': dict(zip(('min', 'p25', 'median', 'p75', 'max'), percentiles))}
+
+
+def _three_by_three_only(feature):
+    def method(self, *args, **kwargs):
+        raise TypeError(f"{feature} only exist for 3x3 boards, not {self.geometry}")
+    return method
+
+
+class LocalRows:
+    # Rows of a PositionTable are handed out in lookup order, so the same
+    # row is a different position in another engine or process. Policy
+    # copies and merges, exact evaluation and frozen policies all index
+    # positions by row, and refuse instead of mixing positions up.
+    move_probabilities = _three_by_three_only("Move probabilities")
+    freeze = _three_by_three_only("Frozen policies")
+    get_policy = set_policy = merge_policy_deltas = _three_by_three_only("Shareable policies")
+
+
+class MnkMenaceEngine(LocalRows, MenaceEngine):
+    # simulate and run_game play on the engine's geometry, and refuse
+    # opponents on another board.
+    def __init__(self, name, geometry=(4, 4, 3), rewards=None, start_tokens=3, min_beads=0, refill='reset',
+                 max_positions=1 << 21, seed=None):
+        self.geometry = as_geometry(geometry)
+        self.arrays = get_board_arrays(self.geometry)
+        boxes = LazyMatchBoxes(PositionTable(self.arrays, max_positions), start_tokens=start_tokens,
+                               min_beads=min_beads, refill=refill, seed=seed)
+        super().__init__(name, rewards, start_tokens, min_beads, refill, seed, boxes=boxes)
+
+    def choose(self, boards):
+        # (box numbers, canonical squares, actual squares) for bitboards.
+        codes, transforms = self.arrays.canonicalize(boards)
+        box_numbers, chosen_tokens = self.boxes.sample_codes(codes)
+        return box_numbers, chosen_tokens, self.arrays.inverse_symmetry_table[transforms, chosen_tokens]
+
+    def play(self, board_state):
+        box_numbers, chosen_tokens, squares = self.choose(np.array([self.geometry.encode_state(board_state)]))
+        self.played_positions.append((int(box_numbers[0]), int(chosen_tokens[0])))
+        return int(squares[0])
+
+    def play_many(self, boards, games):
+        box_numbers, chosen_tokens, squares = self.choose(boards)
+        if self.is_learning:
+            self.batch_positions.append((games, box_numbers, chosen_tokens))
+        return squares
+
+    def get_config(self):
+        return {**super().get_config(), 'geometry': self.geometry.config(),
+                'max_positions': self.boxes.table.max_positions}
+
+
+class MnkQLearningEngine(LocalRows, QLearningEngine):
+    # QLearningEngine with a Q-table row per canonical position seen so far;
+    # row OVERFLOW doubles as the terminal row.
+    def __init__(self, name, geometry=(4, 4, 3), max_positions=1 << 21, **kwargs):
+        self.geometry = as_geometry(geometry)
+        self.arrays = get_board_arrays(self.geometry)
+        self.table = PositionTable(self.arrays, max_positions)
+        super().__init__(name, **kwargs)
+
+    def legal_actions(self):
+        return self.table.legal
+
+    def positions(self, boards):
+        # (rows, transforms, legal squares of the canonical boards).
+        codes, transforms = self.arrays.canonicalize(boards)
+        rows, _ = self.table.lookup(codes)
+        return rows, transforms, self.arrays.legal_move_masks(codes)
+
+    def play(self, board_state):
+        rows, transforms, legal = self.positions(np.array([self.geometry.encode_state(board_state)]))
+        actions = np.flatnonzero(legal[0])
+        action = self.exploration.choose_one(self.q_table[rows[0], actions], actions, self.rng, self.episodes)
+        if self.is_learning:
+            self.trajectory.record(int(rows[0]), action)
+        return self.geometry.inverse_symmetries[transforms[0]][action]
+
+    def play_many(self, boards, games):
+        rows, transforms, legal = self.positions(boards)
+        actions = self.exploration.choose(self.q_table[rows], legal, self.rng, self.episodes)
+        if self.is_learning:
+            self.batch_positions.append((games, rows, actions))
+        return self.arrays.inverse_symmetry_table[transforms, actions]
+
+    def learn_episodes(self, state_ids, actions, rewards, next_ids, steps_to_end):
+        super().learn_episodes(state_ids, actions, rewards, next_ids, steps_to_end)
+        # Moves from positions without a row of their own are not learned.
+        self.q_table[OVERFLOW] = 0.0
+
+    def get_q_value(self, state, action):
+        rows, transforms, _ = self.positions(np.array([self.geometry.encode_state(state)]))
+        return self.q_table[rows[0], self.geometry.symmetries[transforms[0]][action]]
+
+    def get_q_values(self, state, actions):
+        rows, transforms, _ = self.positions(np.array([self.geometry.encode_state(state)]))
+        return self.q_table[rows[0], self.arrays.symmetry_table[transforms[0]][actions]]
+
+    def update_q_table(self, state, action, reward, next_state):
+        rows, transforms, _ = self.positions(np.array([self.geometry.encode_state(state)]))
+        next_row = OVERFLOW
+        if next_state is not None:
+            next_row = self.positions(np.array([self.geometry.encode_state(next_state)]))[0][0]
+        self.apply_td_updates(rows, self.arrays.symmetry_table[transforms, [action]], np.array([reward]),
+                              np.array([next_row]))
+
+    def stats(self):
+        used = self.q_table[1:self.table.size + 1]
+        return {**self.table.stats(), 'q_table_entries': int(np.count_nonzero(used)),
+                'q_table_bytes': int(used.nbytes), 'episodes': self.episodes,
+                'replay_size': len(self.replay) if self.replay is not None else 0}
+
+    def get_config(self):
+        return {**super().get_config(), 'geometry': self.geometry.config(), 'max_positions': self.table.max_positions}
@@ -0,0 +1,57 @@
+from typing import Collection, Optional
+
+import numpy as np
+
+from menace_batch import DRAW, LOSS, SYMMETRY_TABLE, WIN, apply_moves, canonicalize_boards
+from menace_bitboard import N_SQUARES
+from menace_records import GameBatch, read_game_batches
+
+# Bulk training from recorded games. The games of a batch are replayed ply by
+# ply as arrays of bitboards, and each move is handed to the engine's
+# learn_batch as (episode, canonical position, canonical move), so MENACE and
+# Q-learning update their tables with a handful of scatter operations per
+# batch instead of one call per game.
+
+
+def replay_positions(games: GameBatch):
+    # Yields (ply, game numbers, group ids, canonical moves) for every ply.
+    boards = np.zeros(len(games), dtype=np.int64)
+    for ply in range(N_SQUARES):
+        numbers = np.flatnonzero(games.n_moves > ply)
+        if not len(numbers):
+            break
+        squares = games.moves[numbers, ply].astype(np.int64)
+        gids, transforms = canonicalize_boards(boards[numbers])
+        yield ply, numbers, gids, SYMMETRY_TABLE[transforms, squares]
+        boards[numbers] = apply_moves(boards[numbers], squares, ply % 2 + 1)
+
+
+def train_offline(engine, games: GameBatch, players: Collection[int] = (1, 2), names: Optional[Collection[str]] = None):
+    # Teaches engine the moves of the given players (1 moves first) in every
+    # game, or only of the engines whose name is in names. Each game and
+    # player is a separate episode. Returns the number of episodes.
+    n_games = len(games)
+    results = np.where(games.winners == 0, DRAW, np.where(games.winners == 1, WIN, LOSS)).astype(np.int8)
+    results = np.concatenate([results, -results])
+    learners = [np.isin(ids, [i for i, name in games.names.items() if name in names]) if names is not None
+                else np.ones(n_games, dtype=bool) for ids in (games.player1, games.player2)]
+
+    episodes, positions, moves = [], [], []
+    for ply, numbers, gids, canonical_moves in replay_positions(games):
+        player = ply % 2 + 1
+        if player not in players:
+            continue
+        learning = learners[player - 1][numbers]
+        episodes.append(numbers[learning] + n_games * (player - 1))
+        positions.append(gids[learning])
+        moves.append(canonical_moves[learning])
+    if episodes:
+        engine.learn_batch(np.concatenate(episodes), np.concatenate(positions), np.concatenate(moves), results)
+    # Player 1 moves in every game, player 2 in every game of two moves or more.
+    return sum(int((learners[player - 1] & (games.n_moves >= player)).sum()) for player in players)
+
+
+def train_from_log(engine, path, players: Collection[int] = (1, 2), names: Optional[Collection[str]] = None,
+                   chunk_size=1 << 24):
+    # Streams a game log written by menace_records through train_offline.
+    return sum(train_offline(engine, games, players, names) for games in read_game_batches(path, chunk_size))
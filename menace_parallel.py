@@ -0,0 +1,134 @@
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from menace_batch import simulate
+
+# Per-process state of a pool worker, set once by _init_worker.
+_worker = {}
+
+
+class SharedPolicy:
+    # One shared-memory block per engine holding n_workers + 1 copies of its
+    # policy array: slot 0 is the master snapshot the workers start from, slot
+    # i + 1 receives worker i's delta.
+    def __init__(self, policy, n_workers):
+        shape = (n_workers + 1,) + policy.shape
+        self.dtype = policy.dtype
+        self.shape = shape
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * policy.dtype.itemsize)
+        self.slots = np.ndarray(shape, dtype=policy.dtype, buffer=self.shm.buf)
+
+    def spec(self):
+        return self.shm.name, self.shape, self.dtype.str
+
+    def close(self):
+        self.slots = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _init_worker(players, specs, seed):
+    _worker['players'] = players
+    _worker['seed'] = seed
+    _worker['shared'] = [_attach(spec) for spec in specs]
+
+
+def _run_task(task):
+    slot, round_number, n_games, batch_size, episodes = task
+    seed_seq = np.random.SeedSequence(_worker['seed'], spawn_key=(slot, round_number))
+    player_seeds = seed_seq.spawn(len(_worker['players']) + 1)
+
+    policies = []
+    for player, (_, slots), player_seed, player_episodes in zip(_worker['players'], _worker['shared'], player_seeds,
+                                                                episodes):
+        if player_episodes is not None:
+            player.episodes = player_episodes
+        policy = slots[0].copy()
+        player.set_policy(policy)
+        player.set_seed(int(player_seed.generate_state(1)[0]))
+        policies.append(policy)
+
+    playerA, playerB = _worker['players']
+    stats = simulate(playerA, playerB, n_games, batch_size=batch_size, rng=np.random.default_rng(player_seeds[-1]))
+
+    for (_, slots), policy in zip(_worker['shared'], policies):
+        np.subtract(policy, slots[0], out=slots[slot + 1])
+    return stats
+
+
+class ParallelTrainer:
+    # Trains playerA and playerB against each other in a process pool. Each
+    # round, every worker plays games_per_round games from a snapshot of both
+    # policies and reports its deltas, which are merged into the master
+    # engines with merge_policy_deltas. Policies are NumPy arrays and travel
+    # through shared memory, so they are never pickled between rounds.
+    def __init__(self, playerA, playerB, n_workers=None, games_per_round=10000, batch_size=10000, seed=None,
+                 mp_context=None):
+        self.players = (playerA, playerB)
+        self.n_workers = n_workers or os.cpu_count()
+        self.games_per_round = games_per_round
+        self.batch_size = batch_size
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.round_number = 0
+
+        self.shared = [SharedPolicy(player.get_policy(), self.n_workers) for player in self.players]
+        specs = [shared.spec() for shared in self.shared]
+
+        ctx = multiprocessing.get_context(mp_context)
+        self.pool = ctx.Pool(self.n_workers, initializer=_init_worker, initargs=(self.players, specs, self.seed))
+
+    def train_round(self, n_games=None):
+        # n_games is the number of games per worker, or a sequence with each
+        # worker's number of games.
+        per_worker = np.broadcast_to(self.games_per_round if n_games is None else n_games, self.n_workers).tolist()
+        for player, shared in zip(self.players, self.shared):
+            shared.slots[0] = player.get_policy()
+
+        # Engines with an exploration schedule count the games they learned
+        # from; workers start each round from the master's count.
+        episodes = tuple(getattr(player, 'episodes', None) for player in self.players)
+        tasks = [(slot, self.round_number, games, self.batch_size, episodes) for slot, games in enumerate(per_worker)]
+        outcomes = self.pool.map(_run_task, tasks)
+        self.round_number += 1
+
+        for player, shared in zip(self.players, self.shared):
+            player.merge_policy_deltas(shared.slots[1:])
+            if getattr(player, 'episodes', None) is not None:
+                player.episodes += sum(per_worker)
+
+        return tuple(int(sum(column)) for column in zip(*outcomes))
+
+    def train(self, n_games):
+        # Returns playerA's (wins, draws, losses) over all games played.
+        # Exactly n_games are played; the last round splits what is left as
+        # evenly as it can.
+        totals = (0, 0, 0)
+        while n_games > 0:
+            round_games = min(n_games, self.games_per_round * self.n_workers)
+            quotient, remainder = divmod(round_games, self.n_workers)
+            per_worker = [quotient + (slot < remainder) for slot in range(self.n_workers)]
+            stats = self.train_round(per_worker)
+            totals = tuple(a + b for a, b in zip(totals, stats))
+            n_games -= round_games
+        return totals
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        for shared in self.shared:
+            shared.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,159 +1,302 @@
-import random
 import math
-import functools
-from menace_board import *
-from menace2 import *
-
-print = functools.partial(print, flush=True)
-
-
-class QLearningEngine:
-    def __init__(self, name, learning_rate=0.1, discount_factor=0.9, exploration_rate=0.8):
-        self.q_table = {}
-        self.played_positions = []
-        self.is_learning = True
-        self.name = name
+import numpy as np
+from menace_batch import (DRAW, INVERSE_SYMMETRY_TABLE, LOSS, RESULT_LETTERS, WIN, canonicalize_boards,
+                          get_afterstates, get_legal_actions, scatter_sums)
+from menace_bitboard import INVERSE_SYMMETRIES, SYMMETRIES
+from menace_board import get_position
+from menace_engine import Engine
+from menace_exploration import make_exploration
+from menace_game import PrintHooks, make_hooks, run_game
+from menace_metrics import METRICS
+
+DEFAULT_REWARDS = {'W': 1.0, 'L': -1.0, 'D': 0.5}
+# Next-state id of the last move of an episode; row 0 of the Q-table is unused.
+TERMINAL = 0
+
+
+class Trajectory:
+    # One engine's moves in one episode: the canonical state id it moved from,
+    # the canonical action it took and the id of its next decision state.
+    def __init__(self):
+        self.state_ids = []
+        self.actions = []
+        self.next_ids = []
+
+    def __len__(self):
+        return len(self.state_ids)
+
+    def record(self, state_id, action):
+        if self.next_ids:
+            self.next_ids[-1] = state_id
+        self.state_ids.append(state_id)
+        self.actions.append(action)
+        self.next_ids.append(TERMINAL)
+
+    def transitions(self):
+        return np.array(self.state_ids), np.array(self.actions), np.array(self.next_ids)
+
+    def clear(self):
+        self.state_ids = []
+        self.actions = []
+        self.next_ids = []
+
+
+class ReplayBuffer:
+    # Fixed-size ring buffer of (state id, action, reward, next state id).
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.state_ids = np.zeros(capacity, dtype=np.int32)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity)
+        self.next_ids = np.zeros(capacity, dtype=np.int32)
+        self.size = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state_ids, actions, rewards, next_ids):
+        slots = (self.position + np.arange(len(state_ids))) % self.capacity
+        self.state_ids[slots] = state_ids
+        self.actions[slots] = actions
+        self.rewards[slots] = rewards
+        self.next_ids[slots] = next_ids
+        self.position = (self.position + len(state_ids)) % self.capacity
+        self.size = min(self.size + len(state_ids), self.capacity)
+
+    def sample(self, batch_size, rng):
+        slots = rng.integers(self.size, size=batch_size)
+        return self.state_ids[slots], self.actions[slots], self.rewards[slots], self.next_ids[slots]
+
+
+class QLearningEngine(Engine):
+    def __init__(self, name, learning_rate=0.1, discount_factor=0.9, exploration_rate=0.8, seed=None,
+                 rewards=None, replay_capacity=0, replay_batch_size=64, replay_batches=1, trace_decay=0.0,
+                 exploration=None, episodes=0):
+        # One row of action values per canonical state (row = group id, row 0
+        # unused), columns are squares of the canonical state.
+        super().__init__(name)
+        self.set_values(np.zeros(self.policy_shape()))
+        self.rng = np.random.default_rng(seed)
+        self.trajectory = Trajectory()
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
         self.exploration_rate = exploration_rate
-
-    def state_action_str(self, state, action):
-        return f"{state}_{action}"
+        # exploration overrides the constant exploration_rate with a schedule
+        # or selection rule from menace_exploration; trace_decay is the lambda
+        # of TD(lambda), 0 gives one-step Q-learning. episodes counts the games
+        # learned from, which is what the exploration schedules decay over.
+        self.exploration = make_exploration(exploration_rate if exploration is None else exploration)
+        self.trace_decay = trace_decay
+        self.episodes = episodes
+        self.rewards = {**DEFAULT_REWARDS, **(rewards or {})}
+        self.replay = ReplayBuffer(replay_capacity) if replay_capacity else None
+        self.replay_batch_size = replay_batch_size
+        self.replay_batches = replay_batches
+
+    def legal_actions(self):
+        # (rows, squares) bool: the legal moves of each row of the Q-table.
+        return get_legal_actions()
+
+    def policy_shape(self):
+        return self.legal_actions().shape
+
+    def get_values(self):
+        # The array the TD updates write to, which get_policy hands out.
+        return self.q_table
+
+    def set_values(self, values):
+        self.q_table = values
+
+    def action_values(self, state_ids=slice(None)):
+        # The Q-values of every canonical action of the given states.
+        return self.q_table[state_ids]
+
+    def value_indices(self, state_ids, actions):
+        # Where the values of (state, action) pairs live in the flattened
+        # get_values() array.
+        return state_ids * self.q_table.shape[1] + actions
 
     def get_q_value(self, state, action):
-        return self.q_table.get(self.state_action_str(state, action), 0.0)
+        gid, transform = get_position(state)
+        return self.action_values(gid)[SYMMETRIES[transform][action]]
+
+    def get_q_values(self, state, actions):
+        gid, transform = get_position(state)
+        return self.action_values(gid)[np.asarray(SYMMETRIES[transform])[actions]]
 
     def update_q_table(self, state, action, reward, next_state):
-        best_next_action = max([(self.get_q_value(next_state, a), a) for a in self.get_possible_actions(next_state)])[1]
-        current_q_value = self.get_q_value(state, action)
-        learned_value = reward + self.discount_factor * self.get_q_value(next_state, best_next_action)
-        new_q_value = (1 - self.learning_rate) * current_q_value + self.learning_rate * learned_value
-        self.q_table[self.state_action_str(state, action)] = new_q_value
+        # next_state is None when the move ended the game.
+        gid, transform = get_position(state)
+        next_gid = TERMINAL if next_state is None else get_position(next_state)[0]
+        self.apply_td_updates(np.array([gid]), np.array([SYMMETRIES[transform][action]]), np.array([reward]),
+                              np.array([next_gid]))
+
+    def best_next_values(self, next_ids):
+        if len(next_ids) > len(self.legal_actions()):
+            # Cheaper to take the max of every row once and look them up.
+            return self.best_next_values(np.arange(len(self.legal_actions())))[next_ids]
+        legal = self.legal_actions()[next_ids]
+        best_next = np.where(legal, self.action_values(next_ids), -np.inf).max(axis=1)
+        best_next[~legal.any(axis=1)] = 0.0
+        return best_next
+
+    def apply_td_updates(self, state_ids, actions, rewards, next_ids, targets=None):
+        # Moves every Q(s, a) towards its target, by default the one-step TD
+        # target. Repeated (s, a) pairs are moved towards their mean target as
+        # far as that many sequential updates would move them:
+        # 1 - (1 - alpha) ** count.
+        if targets is None:
+            targets = rewards + self.discount_factor * self.best_next_values(next_ids)
+        flat = self.value_indices(state_ids, actions)
+        q_flat = self.get_values().reshape(-1)
+        touched, target_sums, counts = scatter_sums(flat, targets, q_flat.size)
+        mean_targets = target_sums / counts
+        steps = 1.0 - (1.0 - self.learning_rate) ** counts
+        q_flat[touched] += steps * (mean_targets - q_flat[touched])
+        if METRICS.enabled:
+            METRICS.count('qlearning.td_updates', len(flat))
+
+    def learn_episodes(self, state_ids, actions, rewards, next_ids, steps_to_end):
+        # One backward pass over whole episodes: all last moves first, then
+        # all second-to-last moves, and so on, so the final reward reaches
+        # the opening move within the same game. Each move's target is its
+        # lambda-return, r + gamma * ((1 - lambda) * max Q(s') + lambda * G'),
+        # where G' is the target just computed for the following move; this
+        # is the offline form of accumulating eligibility traces.
+        returns = np.zeros(len(state_ids))
+        for step in range(int(steps_to_end.max(initial=-1)) + 1):
+            at_step = np.flatnonzero(steps_to_end == step)
+            bootstrap = self.best_next_values(next_ids[at_step])
+            if step and self.trace_decay:
+                bootstrap += self.trace_decay * (returns[at_step + 1] - bootstrap)
+            returns[at_step] = rewards[at_step] + self.discount_factor * bootstrap
+            self.apply_td_updates(state_ids[at_step], actions[at_step], rewards[at_step], next_ids[at_step],
+                                  returns[at_step])
+        if self.replay is not None:
+            self.replay.add(state_ids, actions, rewards, next_ids)
+            self.replay_updates()
+
+    def replay_updates(self):
+        if len(self.replay) < self.replay_batch_size:
+            return
+        for _ in range(self.replay_batches):
+            self.apply_td_updates(*self.replay.sample(self.replay_batch_size, self.rng))
+
+    def choose_canonical_action(self, gid):
+        actions = np.flatnonzero(self.legal_actions()[gid])
+        return self.exploration.choose_one(self.action_values(gid)[actions], actions, self.rng, self.episodes)
 
     def choose_action(self, state):
-        if random.random() < self.exploration_rate:
-            possible_actions = self.get_possible_actions(state)
-            return random.choice(possible_actions)
-        else:
-            q_values = [self.get_q_value(state, action) for action in self.get_possible_actions(state)]
-            return self.get_possible_actions(state)[np.argmax(q_values)]
+        gid, transform = get_position(state)
+        return INVERSE_SYMMETRIES[transform][self.choose_canonical_action(gid)]
 
     def get_possible_actions(self, state):
         return [i for i in range(9) if state[math.floor(i / 3)][i % 3] == 0]
 
-    def play(self, board_state):
-        action = self.choose_action(board_state)
-        self.played_positions.append(action)
-        return action
+    def move_probabilities(self):
+        return self.exploration.probabilities(self.action_values(), self.legal_actions(), self.episodes)
 
-    def resolve_game(self, result):
-        if not self.is_learning:
-            self.played_positions = []
+    def play(self, board_state):
+        gid, transform = get_position(board_state)
+        action = self.choose_canonical_action(gid)
+        if self.is_learning:
+            self.trajectory.record(gid, action)
+        return INVERSE_SYMMETRIES[transform][action]
+
+    def play_many(self, boards, games):
+        gids, transforms = canonicalize_boards(boards)
+        actions = self.exploration.choose(self.action_values(gids), self.legal_actions()[gids], self.rng, self.episodes)
+        if self.is_learning:
+            self.batch_positions.append((games, gids, actions))
+        return INVERSE_SYMMETRY_TABLE[transforms, actions]
+
+    def learn_batch(self, games, state_ids, actions, results):
+        # Learns from whole episodes at once: action actions[i] was taken
+        # from state_ids[i] in episode games[i], in play order within each
+        # episode, which ended with results[games[i]] for this engine.
+        if not len(games):
             return
+        order = np.argsort(games, kind='stable')
+        games, state_ids, actions = games[order], state_ids[order], actions[order]
+
+        last = np.append(games[1:] != games[:-1], True)
+        next_ids = np.where(last, TERMINAL, np.append(state_ids[1:], TERMINAL))
+        outcome_rewards = np.array([self.rewards[RESULT_LETTERS[code]] for code in (LOSS, DRAW, WIN)])
+        rewards = np.where(last, outcome_rewards[results[games] - LOSS], 0.0)
+        game_ends = np.flatnonzero(last)
+        steps_to_end = game_ends[np.searchsorted(game_ends, np.arange(len(games)))] - np.arange(len(games))
+        self.learn_episodes(state_ids, actions, rewards, next_ids, steps_to_end)
+        # One episode per game the engine moved in, not per result passed.
+        self.episodes += len(game_ends)
 
-        if result == 'W':
-            reward = 1.0
-        elif result == 'L':
-            reward = -1.0
-        else:
-            reward = 0.5
-
-        for state, action in zip(self.played_positions, self.played_positions[1:]):
-            next_state = make_move(state, math.floor(action / 3), action % 3, 1)
-            self.update_q_table(state, action, reward, next_state)
-
-        self.played_positions = []
-
-    def set_learning(self, is_learning):
-        self.is_learning = is_learning
-
-# Example usage:
-
-import numpy as np
-
-def play_game(player1, player2, to_print=True, to_return_winner=False):
-    # Initialize the game board
-    board = np.zeros((3, 3), dtype=int)
-
-    if to_print:
-        print("Initial Board:")
-        print_board(board)
-
-    current_player = player1
-    while True:
-        print(f"{current_player.name}'s turn:")
-        action = current_player.play(board)
-
-        row, col = divmod(action, 3)
-        board[row, col] = 1 
-
-        if to_print:
-            print_board(board)
-
-        game_result = check_game_result(board)
-        if game_result is not None:
-            player1.resolve_game(game_result)
-            player2.resolve_game(game_result)
-
-            if to_print:
-                print("Final Board:")
-                print_board(board)
-                print(f"Result: {game_result}")
-
-            print(f"Game Result: {game_result}")
-
-            if to_return_winner:
-                return game_result
-
-            break
-
-        current_player = player2 if current_player == player1 else player1
-
-def check_game_result(board):
-    for player in [1, 2]:
-        for i in range(3):
-            if all(board[i, j] == player for j in range(3)) or all(board[j, i] == player for j in range(3)):
-                return 'L' if player == 1 else 'W' 
-
-            if all(board[i, i] == player for i in range(3)) or all(board[i, 2 - i] == player for i in range(3)):
-                 return 'W' if player == 1 else 'L' 
-
-    # Check for a draw
-    if all(board[i, j] != 0 for i in range(3) for j in range(3)):
-        print("Debug - Board is filled. Draw!")
-        return 'D'
-
-    return None
-
-def check_game_result_sub(board, player):
-    for i in range(3):
-        if all(board[i, j] == player for j in range(3)) or all(board[j, i] == player for j in range(3)):
-            return 'L' 
-
-    if all(board[i, i] == player for i in range(3)) or all(board[i, 2 - i] == player for i in range(3)):
-        return 'L'  
-
-    return None
-
-def print_board(board):
-    for row in board:
-        print(" ".join(map(str, row)))
-    print()
-
-qLearningEngineA = QLearningEngine(name='qLearningEngineA', learning_rate=0.01, exploration_rate=0.6)
-qLearningEngineB = QLearningEngine(name='qLearningEngineB', learning_rate=0.01, exploration_rate=0.6)
-
-# Play a game and print the Q-table of qLearningEngineA
-play_game(qLearningEngineA, qLearningEngineB, to_print=True)
-print(qLearningEngineA.q_table)
-
-for i in range(1000):
-    play_game(qLearningEngineA, qLearningEngineB, to_print=False)
-
-# Play another game and print the updated Q-table
-play_game(qLearningEngineA, qLearningEngineB, to_print=True)
-print(qLearningEngineA.q_table)
-
-for i in range(200):
-    result = play_game(qLearningEngineA, qLearningEngineB, to_print=False)
-
+    def resolve_game(self, result):
+        if self.is_learning and len(self.trajectory):
+            state_ids, actions, next_ids = self.trajectory.transitions()
+            rewards = np.zeros(len(state_ids))
+            rewards[-1] = self.rewards[result]
+            self.learn_episodes(state_ids, actions, rewards, next_ids, np.arange(len(state_ids))[::-1])
+            self.episodes += 1
+        self.trajectory.clear()
+
+    def stats(self):
+        visited = self.q_table.any(axis=1)
+        return {'q_table_rows': int(visited.sum()), 'q_table_entries': int(np.count_nonzero(self.q_table)),
+                'q_table_bytes': int(self.q_table.nbytes), 'episodes': self.episodes,
+                'replay_size': len(self.replay) if self.replay is not None else 0}
+
+    def set_seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    def get_config(self):
+        return {'name': self.name, 'learning_rate': self.learning_rate, 'discount_factor': self.discount_factor,
+                'exploration_rate': self.exploration_rate, 'rewards': dict(self.rewards),
+                'replay_capacity': self.replay.capacity if self.replay is not None else 0,
+                'replay_batch_size': self.replay_batch_size, 'replay_batches': self.replay_batches,
+                'trace_decay': self.trace_decay, 'exploration': self.exploration.get_config(),
+                'episodes': self.episodes}
+
+    def get_policy(self):
+        return self.get_values()
+
+    def set_policy(self, policy):
+        self.set_values(policy)
+
+    def merge_policy_deltas(self, deltas):
+        # Workers learn from the same snapshot, so their updates are averaged.
+        values = self.get_values()
+        values += np.mean(deltas, axis=0)
+
+class AfterstateEngine(QLearningEngine):
+    # Learns a value per canonical position a move leads to instead of per
+    # (state, action): every move that reaches the same position up to
+    # symmetry shares, and trains, one value. Q(s, a) is read as
+    # V(afterstates[s, a]), so exploration, TD(lambda) and replay work as
+    # in QLearningEngine. Which player moved is fixed by the position, so
+    # each value is from the point of view of the player who just moved.
+    def policy_shape(self):
+        return len(get_afterstates()),
+
+    def action_values(self, state_ids=slice(None)):
+        return self.values[get_afterstates()[state_ids]]
+
+    def value_indices(self, state_ids, actions):
+        return get_afterstates()[state_ids, actions]
+
+    def stats(self):
+        return {'afterstates': len(self.values) - 1, 'afterstate_entries': int(np.count_nonzero(self.values)),
+                'value_bytes': int(self.values.nbytes), 'episodes': self.episodes,
+                'replay_size': len(self.replay) if self.replay is not None else 0}
+
+    def get_values(self):
+        return self.values
+
+    def set_values(self, values):
+        self.values = values
+
+
+def play_game(player1, player2, to_print=True, to_return_winner=False, log=None):
+    # player1 always moves first; the result is from player1's point of view.
+    winner = run_game(player1, player2, hooks=make_hooks(PrintHooks() if to_print else None, log))
+    if to_return_winner:
+        return ('D', 'W', 'L')[winner]
@@ -0,0 +1,222 @@
+import os
+import struct
+from typing import Dict, Iterator, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from menace_bitboard import N_SQUARES, Square
+from menace_game import GameHooks
+
+# Append-only log of finished games. After a short file header the log is a
+# stream of records:
+#   game:   one byte holding the number of moves (low nibble) and the winner,
+#           0 for a draw, 1 or 2 (high nibble); the engine ids of player 1
+#           (who moved first) and player 2, one byte each; then the squares
+#           played, two per byte, first move in the low nibble.
+#   engine: NAME_RECORD, the engine id, the length of its UTF-8 name, the name.
+#           Written once per engine, before its first game.
+# A game takes 3 to 8 bytes.
+MAGIC = b'MENACEGL'
+VERSION = 1
+_HEADER = struct.Struct('<8sH')
+NAME_RECORD = 0xFF
+MAX_ENGINES = 255
+# Size of a game record by its first byte; 0 for name records.
+_RECORD_SIZES = [0 if byte == NAME_RECORD else 3 + ((byte & 0xF) + 1) // 2 for byte in range(256)]
+
+
+class GameRecord(NamedTuple):
+    player1: str
+    player2: str
+    moves: Tuple[Square, ...]
+    winner: int
+
+
+class GameBatch(NamedTuple):
+    # Many games as arrays, one row per game: the engine ids of player 1 and
+    # player 2 (see names), the squares played (n_games, 9) padded with 0,
+    # the number of moves and the winner (0 for a draw).
+    player1: np.ndarray
+    player2: np.ndarray
+    moves: np.ndarray
+    n_moves: np.ndarray
+    winners: np.ndarray
+    names: Dict[int, str]
+
+    def __len__(self):
+        return len(self.winners)
+
+
+def pack_moves(moves: Sequence[Square]) -> bytes:
+    padded = list(moves) + [0] * (len(moves) & 1)
+    return bytes(low | high << 4 for low, high in zip(padded[::2], padded[1::2]))
+
+
+class GameLogWriter(GameHooks):
+    # Buffers records in memory and appends them to path once buffer_size
+    # bytes have accumulated, and on flush() and close(). Also usable as
+    # run_game hooks, which logs every game it plays.
+    def __init__(self, path, buffer_size=1 << 16):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.engine_ids = {} if is_new else {name: engine_id for engine_id, name in read_engine_names(path).items()}
+        self.file = open(path, 'ab')
+        if is_new:
+            self.buffer += _HEADER.pack(MAGIC, VERSION)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def engine_id(self, name: str) -> int:
+        engine_id = self.engine_ids.get(name)
+        if engine_id is None:
+            engine_id = len(self.engine_ids)
+            if engine_id >= MAX_ENGINES:
+                raise ValueError(f"A game log holds at most {MAX_ENGINES} engines")
+            encoded = name.encode()[:255]
+            self.buffer += bytes((NAME_RECORD, engine_id, len(encoded))) + encoded
+            self.engine_ids[name] = engine_id
+        return engine_id
+
+    def write_game(self, player1: str, player2: str, moves: Sequence[Square], winner: int) -> None:
+        id1, id2 = self.engine_id(player1), self.engine_id(player2)
+        self.buffer += bytes((len(moves) | winner << 4, id1, id2)) + pack_moves(moves)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_batch(self, playerA: str, playerB: str, a_first, moves, n_moves, winners) -> None:
+        # One lockstep batch from menace_batch.play_batch: moves is
+        # (n_games, 9) in play order, winners is 0, 1 or 2 per game.
+        idA, idB = self.engine_id(playerA), self.engine_id(playerB)
+        padded = np.zeros((len(moves), 10), dtype=np.uint8)
+        padded[:, :moves.shape[1]] = moves
+        packed = padded[:, ::2] | padded[:, 1::2] << 4
+        heads = np.stack([n_moves | winners.astype(np.uint8) << 4, np.where(a_first, idA, idB),
+                          np.where(a_first, idB, idA)], axis=1).astype(np.uint8)
+        records = np.concatenate([heads, packed], axis=1)
+        for record, n in zip(records, ((n_moves + 1) // 2 + 3).tolist()):
+            self.buffer += record[:n].tobytes()
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def on_game_end(self, winner, player1, player2, board):
+        self.write_game(player1.name, player2.name, board.moves, winner)
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer.clear()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def _check_header(f, path):
+    magic, version = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a MENACE game log")
+    if version != VERSION:
+        raise ValueError(f"Unsupported game log version {version} in {path}, expected {VERSION}")
+
+
+def _records(path, chunk_size) -> Iterator[Tuple]:
+    # Yields ('engine', id, name) and ('game', id1, id2, moves, winner).
+    with open(path, 'rb') as f:
+        _check_header(f, path)
+        buffer = b''
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+            pos = 0
+            while pos < len(buffer):
+                kind = buffer[pos]
+                if kind == NAME_RECORD:
+                    if pos + 3 > len(buffer) or pos + 3 + buffer[pos + 2] > len(buffer):
+                        break
+                    end = pos + 3 + buffer[pos + 2]
+                    yield 'engine', buffer[pos + 1], buffer[pos + 3:end].decode()
+                else:
+                    n_moves = kind & 0xF
+                    end = pos + 3 + (n_moves + 1) // 2
+                    if end > len(buffer):
+                        break
+                    moves = []
+                    for byte in buffer[pos + 3:end]:
+                        moves += (byte & 0xF, byte >> 4)
+                    yield 'game', buffer[pos + 1], buffer[pos + 2], tuple(moves[:n_moves]), kind >> 4
+                pos = end
+            buffer = buffer[pos:]
+            if not chunk:
+                if buffer:
+                    raise ValueError(f"{path} ends with a truncated record")
+                return
+
+
+def read_games(path, chunk_size=1 << 16) -> Iterator[GameRecord]:
+    # Streams the games of a log, reading chunk_size bytes at a time.
+    names = {}
+    for record in _records(path, chunk_size):
+        if record[0] == 'engine':
+            names[record[1]] = record[2]
+        else:
+            _, id1, id2, moves, winner = record
+            yield GameRecord(names[id1], names[id2], moves, winner)
+
+
+def read_engine_names(path, chunk_size=1 << 16) -> Dict[int, str]:
+    return {record[1]: record[2] for record in _records(path, chunk_size) if record[0] == 'engine'}
+
+
+def read_game_batches(path, chunk_size=1 << 24) -> Iterator[GameBatch]:
+    # Streams the games of a log as GameBatch arrays, one per chunk_size
+    # bytes read, for vectorized processing of large logs.
+    names = {}
+    with open(path, 'rb') as f:
+        _check_header(f, path)
+        buffer = b''
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+            starts = []
+            pos = 0
+            end = len(buffer)
+            while pos < end:
+                size = _RECORD_SIZES[buffer[pos]]
+                if not size:
+                    if pos + 3 > end or pos + 3 + buffer[pos + 2] > end:
+                        break
+                    size = 3 + buffer[pos + 2]
+                    names[buffer[pos + 1]] = buffer[pos + 3:pos + size].decode()
+                elif pos + size > end:
+                    break
+                else:
+                    starts.append(pos)
+                pos += size
+
+            if starts:
+                data = np.frombuffer(buffer, dtype=np.uint8, count=pos)
+                starts = np.array(starts)
+                heads = data[starts]
+                # Gather five move bytes per game, including bytes past the
+                # end of short records, which are masked out below.
+                packed = data[np.minimum(starts[:, None] + np.arange(3, 8), pos - 1)]
+                moves = np.empty((len(starts), 10), dtype=np.uint8)
+                moves[:, ::2] = packed & 0xF
+                moves[:, 1::2] = packed >> 4
+                n_moves = heads & 0xF
+                moves = np.where(np.arange(N_SQUARES) < n_moves[:, None], moves[:, :N_SQUARES], 0).astype(np.uint8)
+                yield GameBatch(data[starts + 1], data[starts + 2], moves, n_moves, (heads >> 4).astype(np.int8),
+                                dict(names))
+
+            buffer = buffer[pos:]
+            if not chunk:
+                if buffer:
+                    raise ValueError(f"{path} ends with a truncated record")
+                return
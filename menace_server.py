@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import functools
+
+import numpy as np
+
+from menace import MenaceEngine
+from menace_batch import DRAW, LOSS, WIN
+from menace_bitboard import SYMMETRIES, decode_board
+from menace_board import get_state_index
+from menace_checkpoint import load_engine
+from menace_frozen import FrozenPolicy
+from menace_game import GameBoard
+from menace_qlearning import AfterstateEngine, QLearningEngine
+
+print = functools.partial(print, flush=True)
+
+# Line protocol, one request and one reply per line:
+#   NEW X | NEW O    start a game, moving first (X) or second (O)
+#   MOVE <square>    play a square, 0-8 in reading order
+#   QUIT             close the connection
+# Every request except QUIT is answered with
+#   BOARD <engine square or -> <board> <PLAY|WIN|LOSS|DRAW>
+# where board is nine digits (0 empty, 1 for the first player, 2 for the
+# second) and the status is from the client's point of view, or with
+#   ERROR <message>
+STATUS = {WIN: 'WIN', DRAW: 'DRAW', LOSS: 'LOSS'}
+
+
+def freeze_policy(probabilities, greedy, name, seed):
+    return FrozenPolicy(probabilities, greedy).player(name, seed)
+
+
+class MoveBatcher:
+    # Collects the move requests of all games and answers them with one
+    # play_many call per batch.
+    def __init__(self, server, max_batch=1024):
+        self.server = server
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+
+    async def move(self, board):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((board, future))
+        return await future
+
+    async def run(self):
+        while True:
+            requests = [await self.queue.get()]
+            # Let the other games queue their requests before answering.
+            await asyncio.sleep(0)
+            while len(requests) < self.max_batch and not self.queue.empty():
+                requests.append(self.queue.get_nowait())
+            boards = np.array([board for board, _ in requests], dtype=np.int64)
+            try:
+                squares = self.server.player.play_many(boards, np.arange(len(boards)))
+            except Exception as error:
+                # Fail this batch's games rather than the batcher.
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.server.moves += len(requests)
+            self.server.batches += 1
+            for (_, future), square in zip(requests, squares.tolist()):
+                if not future.done():
+                    future.set_result(square)
+
+
+class GameServer:
+    # Serves games against one engine. Moves come from a frozen copy of the
+    # engine; with learn=True finished games go through a single update
+    # queue into the engine, which is re-frozen every refreeze_games games.
+    def __init__(self, engine, learn=False, greedy=False, max_batch=1024, refreeze_games=1000, seed=None):
+        self.engine = engine
+        self.learn = learn
+        self.greedy = greedy
+        self.refreeze_games = refreeze_games
+        self.rng = np.random.default_rng(seed)
+        self.player = engine.freeze(greedy, self.rng.integers(1 << 63))
+        self.batcher = MoveBatcher(self, max_batch)
+        self.updates = asyncio.Queue()
+        self.games = self.moves = self.batches = 0
+        self.tasks = []
+        self.connections = set()
+
+    def start(self):
+        self.tasks.append(asyncio.create_task(self.batcher.run()))
+        if self.learn:
+            self.tasks.append(asyncio.create_task(self.learner()))
+
+    async def stop(self, timeout=1.0):
+        # Gives open connections timeout seconds to finish, then cancels
+        # them and the background tasks.
+        if self.connections:
+            await asyncio.wait(self.connections, timeout=timeout)
+        tasks = self.tasks + list(self.connections)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def learner(self):
+        # The only writer of the engine's tables.
+        learned = 0
+        while True:
+            games = [await self.updates.get()]
+            while not self.updates.empty():
+                games.append(self.updates.get_nowait())
+            episodes = np.repeat(np.arange(len(games)), [len(positions) for positions, _ in games])
+            positions = np.array([position for game, _ in games for position in game], dtype=np.int64)
+            results = np.array([result for _, result in games], dtype=np.int8)
+            self.engine.learn_batch(episodes, positions[:, 0], positions[:, 1], results)
+            learned += len(games)
+            if learned >= self.refreeze_games:
+                # Building the alias tables is slow, so it runs off the event
+                # loop on a copy of the policy; games keep the old player
+                # until the new one is ready.
+                freeze = functools.partial(freeze_policy, self.engine.move_probabilities(), self.greedy,
+                                           self.engine.name, self.rng.integers(1 << 63))
+                self.player = await asyncio.get_running_loop().run_in_executor(None, freeze)
+                learned = 0
+
+    async def engine_move(self, board, positions):
+        square = await self.batcher.move(board.bits)
+        if self.learn:
+            gid, transform = get_state_index().board_positions[board.bits]
+            positions.append((gid, SYMMETRIES[transform][square]))
+        board.make_move(square)
+        return square
+
+    def reply(self, board, engine_square, client_player, positions):
+        if board.has_won(client_player):
+            result = WIN
+        elif board.has_won(3 - client_player):
+            result = LOSS
+        elif board.is_full():
+            result = DRAW
+        else:
+            result = None
+        if result is not None:
+            self.games += 1
+            if self.learn and positions:
+                self.updates.put_nowait((positions, -result))
+        cells = ''.join(str(cell) for row in decode_board(board.bits) for cell in row)
+        status = 'PLAY' if result is None else STATUS[result]
+        return f"BOARD {'-' if engine_square is None else engine_square} {cells} {status}", result
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        board = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = line.decode().split()
+                if not request:
+                    continue
+                command, args = request[0].upper(), request[1:]
+                if command == 'QUIT':
+                    break
+                if command == 'NEW' and args and args[0].upper() in ('X', 'O'):
+                    board, positions = GameBoard(), []
+                    client_player = 1 if args[0].upper() == 'X' else 2
+                    engine_square = None if client_player == 1 else await self.engine_move(board, positions)
+                    response, _ = self.reply(board, engine_square, client_player, positions)
+                elif command == 'MOVE' and board is not None and len(args) == 1 and args[0].isdigit():
+                    try:
+                        board.make_move(int(args[0]))
+                    except ValueError:
+                        response = f"ERROR Illegal move {args[0]}"
+                    else:
+                        response, result = self.reply(board, None, client_player, positions)
+                        if result is None:
+                            engine_square = await self.engine_move(board, positions)
+                            response, result = self.reply(board, engine_square, client_player, positions)
+                        if result is not None:
+                            board = None
+                elif command == 'MOVE':
+                    response = "ERROR No game in progress" if board is None else "ERROR Usage: MOVE <square>"
+                else:
+                    response = f"ERROR Unknown request {line.decode().strip()!r}"
+                writer.write(response.encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            self.connections.discard(task)
+
+    def stats(self):
+        return {'games': self.games, 'moves': self.moves, 'batches': self.batches,
+                'mean_batch': self.moves / self.batches if self.batches else 0.0}
+
+
+async def start_server(server, host='127.0.0.1', port=0, unix_path=None):
+    server.start()
+    if unix_path is not None:
+        return await asyncio.start_unix_server(server.handle, unix_path, backlog=4096)
+    return await asyncio.start_server(server.handle, host, port, backlog=4096)
+
+
+def make_server_engine(args):
+    if args.checkpoint:
+        return load_engine(args.checkpoint)
+    if args.engine == 'menace':
+        return MenaceEngine('server', seed=args.seed)
+    if args.engine == 'afterstate':
+        return AfterstateEngine('server', seed=args.seed)
+    return QLearningEngine('server', seed=args.seed)
+
+
+async def serve(args):
+    server = GameServer(make_server_engine(args), learn=args.learn, greedy=args.greedy, max_batch=args.max_batch,
+                        refreeze_games=args.refreeze_games, seed=args.seed)
+    listener = await start_server(server, args.host, args.port, args.unix)
+    address = args.unix or '{}:{}'.format(*listener.sockets[0].getsockname()[:2])
+    print(f"Serving {server.engine.name} on {address}")
+    async with listener:
+        await listener.serve_forever()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Serve games against a trained engine over a line protocol.")
+    parser.add_argument('--checkpoint', help="engine checkpoint to serve (default: an untrained engine)")
+    parser.add_argument('--engine', choices=('menace', 'qlearning', 'afterstate'), default='menace')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--learn', action='store_true', help="keep training the engine on the games it serves")
+    parser.add_argument('--refreeze-games', type=int, default=1000,
+                        help="with --learn, games between refreshing the served policy")
+    parser.add_argument('--greedy', action='store_true', help="always play the engine's most likely move")
+    parser.add_argument('--max-batch', type=int, default=1024, help="most move requests answered in one call")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser
+
+
+def main(argv=None):
+    try:
+        asyncio.run(serve(build_parser().parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
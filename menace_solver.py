@@ -0,0 +1,109 @@
+import threading
+from numbers import Integral
+from typing import Optional, Tuple
+
+import numpy as np
+
+from menace_batch import INVERSE_SYMMETRY_TABLE, LOSS, canonicalize_boards
+from menace_bitboard import INVERSE_SYMMETRIES, N_SQUARES, Square, apply_move, encode_state, occupied_mask
+from menace_board import DRAW, get_position, get_state_index
+
+class Solution:
+    # Game-theoretic value of every canonical position for the player to move
+    # (WIN, DRAW or LOSS, row = group id) and, per position, the canonical
+    # squares that keep that value.
+    def __init__(self, values: np.ndarray, optimal: np.ndarray):
+        self.values = values
+        self.optimal = optimal
+
+
+def player_to_move(board) -> int:
+    return bin(occupied_mask(board)).count('1') % 2 + 1
+
+
+def _solve() -> Solution:
+    # Backward induction over the state graph, deepest positions first.
+    graph = get_state_index().graph
+    values = np.where(graph.outcome > DRAW, LOSS, DRAW).astype(np.int8)
+    optimal = np.zeros((len(graph.codes), N_SQUARES), dtype=bool)
+    sources = graph.edge_sources()
+    edge_depth = graph.depth[sources]
+    for depth in range(N_SQUARES - 1, -1, -1):
+        edges = np.flatnonzero(edge_depth == depth)
+        parents, move_values = sources[edges], -values[graph.successors[edges]]
+        best = np.full(len(values), LOSS, dtype=np.int8)
+        np.maximum.at(best, parents, move_values)
+        values[parents] = best[parents]
+        best_edges = move_values == values[parents]
+        optimal[parents[best_edges], graph.moves[edges][best_edges]] = True
+    values.setflags(write=False)
+    optimal.setflags(write=False)
+    return Solution(values, optimal)
+
+
+_solution: Optional[Solution] = None
+_solution_lock = threading.Lock()
+
+
+def solve() -> Solution:
+    global _solution
+    if _solution is None:
+        with _solution_lock:
+            if _solution is None:
+                _solution = _solve()
+    return _solution
+
+
+def game_value(state) -> int:
+    # WIN, DRAW or LOSS for the player to move, under perfect play.
+    return int(solve().values[get_position(state)[0]])
+
+
+def optimal_moves(state) -> Tuple[Square, ...]:
+    gid, transform = get_position(state)
+    inverse = INVERSE_SYMMETRIES[transform]
+    return tuple(sorted(inverse[square] for square in np.flatnonzero(solve().optimal[gid]).tolist()))
+
+
+def move_regret(state, square: Square) -> int:
+    # How much a move gives away under perfect play: 0 for an optimal move,
+    # 1 for turning a win into a draw or a draw into a loss, 2 for turning a
+    # win into a loss.
+    board = state if isinstance(state, Integral) else encode_state(state)
+    values = solve().values
+    child = apply_move(board, square, player_to_move(board))
+    return int(values[get_position(board)[0]]) + int(values[get_position(child)[0]])
+
+
+class OptimalPlayer:
+    # Plays a uniformly random optimal move; never learns.
+    def __init__(self, name='optimal', seed=None):
+        self.name = name
+        self.is_learning = False
+        self.rng = np.random.default_rng(seed)
+
+    def move_probabilities(self):
+        optimal = solve().optimal
+        return optimal / np.maximum(optimal.sum(axis=1, keepdims=True), 1)
+
+    def play(self, board_state):
+        moves = optimal_moves(board_state)
+        return moves[int(self.rng.random() * len(moves))]
+
+    def play_many(self, boards, games):
+        gids, transforms = canonicalize_boards(boards)
+        optimal = solve().optimal[gids]
+        choices = np.where(optimal, self.rng.random(optimal.shape), -1.0).argmax(axis=1)
+        return INVERSE_SYMMETRY_TABLE[transforms, choices]
+
+    def resolve_game(self, result):
+        pass
+
+    def resolve_many(self, results):
+        pass
+
+    def set_learning(self, is_learning):
+        pass
+
+    def set_seed(self, seed):
+        self.rng = np.random.default_rng(seed)
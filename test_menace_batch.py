@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from menace import MenaceEngine
+from menace_batch import DRAW, LOSS, WIN, play_batch, simulate
+from menace_bitboard import TIC_TAC_TOE, get_geometry
+from menace_game import GameHooks, run_game
+from menace_mnk import MnkMenaceEngine
+from menace_records import GameLogWriter, read_games
+
+
+class HashPlayer:
+    # Picks a legal square from a hash of the board and the game number, the
+    # same way on both the single-game and the batch path.
+    def __init__(self, name, salt, geometry=TIC_TAC_TOE):
+        self.name = name
+        self.salt = salt
+        self.geometry = geometry
+        self.is_learning = False
+        self.game = 0
+
+    def choose(self, board, game):
+        moves = self.geometry.legal_moves(board)
+        return moves[(board * 2654435761 + game * 40503 + self.salt) % 1000003 % len(moves)]
+
+    def play(self, board_state):
+        return self.choose(self.geometry.encode_state(board_state), self.game)
+
+    def play_many(self, boards, games):
+        return np.array([self.choose(board, game) for board, game in zip(boards.tolist(), games.tolist())],
+                        dtype=np.int64)
+
+    def resolve_game(self, result):
+        pass
+
+    def resolve_many(self, results):
+        pass
+
+
+class MoveRecorder(GameHooks):
+    def on_game_end(self, winner, player1, player2, board):
+        self.moves = tuple(board.moves)
+        self.winner = winner
+
+
+def test_batch_matches_single_games(tmp_path):
+    engine = MenaceEngine('menace', seed=0)
+    simulate(engine, HashPlayer('trainer', 1), 3000, rng=1)
+    players = {'menace': engine.freeze(greedy=True), 'hash': HashPlayer('hash', 7)}
+    with GameLogWriter(tmp_path / 'games.log') as log:
+        results = play_batch(players['menace'], players['hash'], 200, rng=2, log=log)
+
+    records = list(read_games(tmp_path / 'games.log'))
+    assert len(records) == len(results) == 200
+    assert {record.player1 for record in records} == {'menace', 'hash'}
+    assert len({record.moves for record in records}) > 100
+    recorder = MoveRecorder()
+    for game, (record, result) in enumerate(zip(records, results.tolist())):
+        players['hash'].game = game
+        winner = run_game(players[record.player1], players[record.player2], recorder)
+        assert (recorder.moves, recorder.winner) == (record.moves, record.winner)
+        greedy_player = 1 if record.player1 == 'menace' else 2
+        assert result == (DRAW if winner == DRAW else WIN if winner == greedy_player else LOSS)
+
+
+def test_batch_matches_single_games_on_larger_boards():
+    geometry = get_geometry(4, 4, 3)
+    a, b = HashPlayer('a', 3, geometry), HashPlayer('b', 11, geometry)
+    first = np.random.default_rng(4).random(100) < 0.5
+    expected = []
+    for game in range(100):
+        a.game = b.game = game
+        winner = run_game(a, b) if first[game] else run_game(b, a)
+        expected.append(DRAW if winner == DRAW else WIN if (winner == 1) == first[game] else LOSS)
+    assert play_batch(a, b, 100, rng=4).tolist() == expected
+
+
+def test_illegal_batch_moves_are_rejected():
+    class Stubborn(HashPlayer):
+        def play_many(self, boards, games):
+            return np.full(len(boards), 4)
+
+    with pytest.raises(ValueError, match='Illegal move 4 by stubborn'):
+        play_batch(HashPlayer('hash', 1), Stubborn('stubborn', 0), 50, rng=5)
+
+
+def test_players_must_share_a_board():
+    with pytest.raises(ValueError, match='plays on'):
+        play_batch(MnkMenaceEngine('mnk'), MenaceEngine('menace'), 10)
+    with pytest.raises(ValueError, match='plays on'):
+        play_batch(MnkMenaceEngine('a'), MnkMenaceEngine('b'), 10, geometry=TIC_TAC_TOE)
+    assert len(play_batch(MnkMenaceEngine('a', seed=1), MnkMenaceEngine('b', seed=2), 10, rng=6)) == 10
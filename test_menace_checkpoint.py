@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from menace import MenaceEngine
+from menace_batch import simulate
+from menace_checkpoint import load_engine, load_metadata, load_policy, save_engine, save_policy
+from menace_exploration import LinearEpsilon
+from menace_mnk import MnkMenaceEngine
+from menace_qlearning import AfterstateEngine, QLearningEngine
+from menace_solver import OptimalPlayer
+
+ENGINES = [lambda: MenaceEngine('menace', rewards={'W': 4}, refill='uniform', seed=1),
+           lambda: QLearningEngine('qlearning', learning_rate=0.3, trace_decay=0.5,
+                                   exploration=LinearEpsilon(0.5, 0.1, 1000), seed=2),
+           lambda: AfterstateEngine('afterstate', discount_factor=0.8, seed=3)]
+
+
+@pytest.fixture(params=ENGINES, ids=['menace', 'qlearning', 'afterstate'])
+def engine(request):
+    engine = request.param()
+    simulate(engine, OptimalPlayer(seed=4), 2000, rng=5)
+    return engine
+
+
+@pytest.mark.parametrize('mmap_mode', ['c', 'r', None])
+def test_round_trip(tmp_path, engine, mmap_mode):
+    path = tmp_path / 'engine.ckpt'
+    save_engine(engine, path, games=2000)
+    loaded = load_engine(path, mmap_mode)
+    assert type(loaded) is type(engine)
+    assert loaded.get_config() == engine.get_config()
+    assert loaded.get_policy().dtype == engine.get_policy().dtype
+    np.testing.assert_array_equal(loaded.get_policy(), engine.get_policy())
+    assert load_metadata(path)['extra'] == {'games': 2000}
+    assert loaded.is_learning == (mmap_mode != 'r')
+
+
+def test_loaded_engine_plays_and_learns_the_same(tmp_path, engine):
+    path = tmp_path / 'engine.ckpt'
+    save_engine(engine, path)
+    loaded = load_engine(path)
+    results = []
+    for player in (engine, loaded):
+        player.set_seed(6)
+        results.append(simulate(player, OptimalPlayer(seed=7), 1000, rng=8))
+    assert results[0] == results[1]
+    np.testing.assert_array_equal(loaded.get_policy(), engine.get_policy())
+    # Copy-on-write: learning never touches the file.
+    assert not np.array_equal(load_policy(path)[0], loaded.get_policy())
+
+
+def test_policy_shapes(tmp_path):
+    for policy in (np.arange(5, dtype=np.float32), np.arange(12, dtype=np.int16).reshape(3, 4), np.zeros((0, 9))):
+        save_policy(tmp_path / 'policy', policy, {'note': 'x'})
+        loaded, metadata = load_policy(tmp_path / 'policy', mmap_mode=None)
+        assert loaded.dtype == policy.dtype and metadata['note'] == 'x'
+        np.testing.assert_array_equal(loaded, policy)
+    with pytest.raises(ValueError):
+        save_policy(tmp_path / 'policy', np.zeros((2, 2, 2)), {})
+
+
+def test_rejects_other_files_and_engines(tmp_path):
+    path = tmp_path / 'engine.ckpt'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError, match='not a MENACE checkpoint'):
+        load_engine(path)
+    with pytest.raises(ValueError, match='Cannot checkpoint'):
+        save_engine(MnkMenaceEngine('mnk'), path)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from menace_batch import get_legal_actions
+from menace_bitboard import EMPTY_BOARD, SYMMETRIES, apply_move, has_won, legal_moves
+from menace_board import get_position
+from menace_evaluation import evaluate, evaluate_policies, evaluate_policy_pairs
+from menace_solver import OptimalPlayer, player_to_move
+
+
+def random_policy(rng):
+    weights = rng.random(get_legal_actions().shape) * get_legal_actions()
+    return weights / np.maximum(weights.sum(axis=1, keepdims=True), 1e-300)
+
+
+def outcome_probabilities(first, second):
+    # (first wins, draw, second wins) by walking the game tree on actual
+    # boards.
+    cache = {}
+
+    def walk(board):
+        if board not in cache:
+            player = player_to_move(board)
+            moves = legal_moves(board)
+            if has_won(board, 3 - player):
+                cache[board] = np.eye(3)[0 if player == 2 else 2]
+            elif not moves:
+                cache[board] = np.eye(3)[1]
+            else:
+                gid, transform = get_position(board)
+                policy = (first, second)[player - 1]
+                cache[board] = sum(policy[gid, SYMMETRIES[transform][square]] * walk(apply_move(board, square, player))
+                                   for square in moves)
+        return cache[board]
+
+    return walk(EMPTY_BOARD)
+
+
+def test_uniform_random_play():
+    uniform = get_legal_actions() / np.maximum(get_legal_actions().sum(axis=1, keepdims=True), 1)
+    first_wins, draws, second_wins = evaluate_policies(uniform, uniform)
+    # The known outcome probabilities of random tic-tac-toe.
+    assert first_wins == pytest.approx(737 / 1260)
+    assert draws == pytest.approx(160 / 1260)
+    assert second_wins == pytest.approx(363 / 1260)
+
+
+def test_matches_game_tree():
+    rng = np.random.default_rng(0)
+    first, second = random_policy(rng), random_policy(rng)
+    np.testing.assert_allclose(evaluate_policies(first, second), outcome_probabilities(first, second))
+
+
+def test_policy_pairs_match_single_pairs():
+    rng = np.random.default_rng(1)
+    policies = np.stack([random_policy(rng) for _ in range(4)])
+    first, second = [0, 1, 2, 3, 3], [1, 0, 3, 2, 3]
+    results = evaluate_policy_pairs(policies, first, second, chunk_size=2)
+    for result, a, b in zip(results, first, second):
+        np.testing.assert_allclose(result, evaluate_policies(policies[a], policies[b]))
+    np.testing.assert_allclose(results.sum(axis=1), 1.0)
+
+
+def test_optimal_play_draws():
+    assert evaluate(OptimalPlayer(), OptimalPlayer()) == pytest.approx((0.0, 1.0, 0.0))
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from menace import MenaceEngine
+from menace_bitboard import INVERSE_SYMMETRIES, decode_board, encode_state
+from menace_board import get_position
+from menace_frozen import build_alias_table
+
+MID_GAME = ((1, 0, 0), (0, 2, 0), (0, 0, 0))
+
+
+def alias_distribution(prob, alias):
+    # The distribution an alias table samples from.
+    n_rows, n_columns = prob.shape
+    distribution = prob / n_columns
+    for column in range(n_columns):
+        np.add.at(distribution, (np.arange(n_rows), alias[:, column]), (1 - prob[:, column]) / n_columns)
+    return distribution
+
+
+def test_alias_table_matches_weights():
+    rng = np.random.default_rng(0)
+    weights = rng.random((500, 9)) * (rng.random((500, 9)) < 0.6)
+    weights[:3] = 0
+    weights[3] = np.eye(9)[4]
+    prob, alias = build_alias_table(weights)
+    assert ((prob >= 0) & (prob <= 1)).all()
+    live = weights.sum(axis=1) > 0
+    np.testing.assert_allclose(alias_distribution(prob, alias)[live],
+                               weights[live] / weights[live].sum(axis=1, keepdims=True), atol=1e-12)
+    assert (prob[~live] == 1).all()
+
+
+def bead_engine():
+    engine = MenaceEngine('menace', seed=0)
+    engine.boxes.beads[:] = np.random.default_rng(1).integers(1, 6, engine.boxes.beads.shape) * engine.boxes.legal
+    return engine
+
+
+def test_sampled_moves_follow_bead_counts():
+    engine = bead_engine()
+    gid, transform = get_position(MID_GAME)
+    beads = engine.boxes.beads[gid].astype(float)
+    expected = np.zeros(9)
+    expected[list(INVERSE_SYMMETRIES[transform])] = beads / beads.sum()
+
+    player = engine.freeze(seed=2)
+    n_moves = 200000
+    squares = player.play_many(np.full(n_moves, encode_state(MID_GAME)), np.arange(n_moves))
+    np.testing.assert_allclose(np.bincount(squares, minlength=9) / n_moves, expected, atol=0.005)
+    singles = [player.play(MID_GAME) for _ in range(20000)]
+    np.testing.assert_allclose(np.bincount(singles, minlength=9) / len(singles), expected, atol=0.015)
+
+
+def test_greedy_plays_most_likely_move():
+    engine = bead_engine()
+    gid, transform = get_position(MID_GAME)
+    best = INVERSE_SYMMETRIES[transform][int(engine.boxes.beads[gid].argmax())]
+    player = engine.freeze(greedy=True)
+    assert player.play(MID_GAME) == best
+    assert player.play_many(np.array([encode_state(MID_GAME)] * 3), np.arange(3)).tolist() == [best] * 3
+
+
+def test_unreachable_board():
+    player = MenaceEngine('menace', seed=0).freeze(seed=0)
+    board = encode_state(((1, 1, 1), (1, 0, 0), (0, 0, 0)))
+    with pytest.raises(ValueError, match='not among the reachable states'):
+        player.play(decode_board(board))
+    with pytest.raises(ValueError, match='not among the reachable states'):
+        player.play_many(np.array([0, board]), np.arange(2))
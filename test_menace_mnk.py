@@ -0,0 +1,69 @@
+import numpy as np
+
+from menace_batch import get_board_arrays
+from menace_bitboard import get_geometry
+from menace_mnk import OVERFLOW, PositionTable
+
+
+def random_boards(rng, n_boards, n_squares=16):
+    # Distinct bitboards, not necessarily reachable ones.
+    first = rng.integers(0, 1 << n_squares, 4 * n_boards)
+    second = rng.integers(0, 1 << n_squares, 4 * n_boards) & ~first
+    return np.unique(first | second << n_squares)[:n_boards]
+
+
+def make_table(max_positions=1 << 21):
+    return PositionTable(get_board_arrays(get_geometry(4, 4, 3)), max_positions)
+
+
+def test_lookup_across_resizes_keeps_rows():
+    rng = np.random.default_rng(0)
+    table = make_table()
+    boards = rng.permutation(random_boards(rng, 20000))
+    n_slots = len(table.keys)
+    rows = []
+    for batch in np.array_split(boards, 7):
+        batch_rows, added = table.lookup(batch)
+        np.testing.assert_array_equal(np.sort(added), np.sort(batch_rows))
+        rows.append(batch_rows)
+    rows = np.concatenate(rows)
+    assert len(table.keys) > n_slots
+    assert len(table) == len(boards)
+    np.testing.assert_array_equal(np.sort(rows), np.arange(1, len(boards) + 1))
+    np.testing.assert_array_equal(table.codes[rows], boards)
+    np.testing.assert_array_equal(table.legal[rows], table.arrays.legal_move_masks(boards))
+
+    again, added = table.lookup(boards[::-1])
+    np.testing.assert_array_equal(again, rows[::-1])
+    assert len(added) == 0
+
+
+def test_lookup_repeated_boards_in_one_batch():
+    rng = np.random.default_rng(1)
+    table = make_table()
+    boards = random_boards(rng, 100)
+    batch = np.concatenate([boards, boards[::-1], boards[:10]])
+    rows, added = table.lookup(batch)
+    assert len(added) == len(boards) == len(table)
+    np.testing.assert_array_equal(rows[:100], rows[100:200][::-1])
+    np.testing.assert_array_equal(rows[:10], rows[200:])
+
+
+def test_lookup_overflow_keeps_rows():
+    rng = np.random.default_rng(2)
+    table = make_table(max_positions=1000)
+    boards = random_boards(rng, 3000)
+    first, _ = table.lookup(boards[:600])
+    rows, added = table.lookup(boards)
+    assert len(table) == 1000 and len(added) == 400
+    np.testing.assert_array_equal(rows[:600], first)
+    known = rows != OVERFLOW
+    assert known.sum() == 1000
+    np.testing.assert_array_equal(np.sort(rows[known]), np.arange(1, 1001))
+    np.testing.assert_array_equal(table.codes[rows[known]], boards[known])
+    assert table.stats()['overflow_lookups'] == 2000
+
+    again, added = table.lookup(boards)
+    np.testing.assert_array_equal(again, rows)
+    assert len(added) == 0
+    assert not table.legal[OVERFLOW].any()
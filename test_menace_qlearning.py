@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from menace_batch import DRAW, LOSS, WIN, get_legal_actions
+from menace_bitboard import EMPTY_BOARD, SYMMETRIES, apply_move, has_won, is_full, legal_moves
+from menace_board import get_position
+from menace_qlearning import TERMINAL, AfterstateEngine, QLearningEngine
+
+
+def random_episode(rng, player=1):
+    # A random game's (state ids, canonical actions) for player's moves and
+    # player's result.
+    board, mover, state_ids, actions = EMPTY_BOARD, 1, [], []
+    while True:
+        square = int(rng.choice(legal_moves(board)))
+        if mover == player:
+            gid, transform = get_position(board)
+            state_ids.append(gid)
+            actions.append(SYMMETRIES[transform][square])
+        board = apply_move(board, square, mover)
+        if has_won(board, mover):
+            return np.array(state_ids), np.array(actions), WIN if mover == player else LOSS
+        if is_full(board):
+            return np.array(state_ids), np.array(actions), DRAW
+        mover = 3 - mover
+
+
+def transitions(state_ids, reward):
+    rewards = np.zeros(len(state_ids))
+    rewards[-1] = reward
+    next_ids = np.append(state_ids[1:], TERMINAL)
+    return rewards, next_ids, np.arange(len(state_ids))[::-1]
+
+
+def lambda_returns_reference(q, state_ids, actions, rewards, next_ids, alpha, gamma, lam):
+    # The backward pass one move at a time, on a copy of q.
+    q = q.copy()
+    legal = get_legal_actions()
+    following = None
+    for t in range(len(state_ids) - 1, -1, -1):
+        nxt = next_ids[t]
+        best = q[nxt][legal[nxt]].max() if legal[nxt].any() else 0.0
+        if following is not None and lam:
+            best += lam * (following - best)
+        following = rewards[t] + gamma * best
+        q[state_ids[t], actions[t]] += alpha * (following - q[state_ids[t], actions[t]])
+    return q
+
+
+@pytest.mark.parametrize('trace_decay', [0.0, 0.6, 1.0])
+def test_learn_episodes_matches_sequential_backups(trace_decay):
+    rng = np.random.default_rng(0)
+    engine = QLearningEngine('q', learning_rate=0.3, discount_factor=0.9, trace_decay=trace_decay)
+    engine.set_policy(rng.normal(size=get_legal_actions().shape) * get_legal_actions())
+    for player in (1, 2, 1, 2):
+        state_ids, actions, result = random_episode(rng, player)
+        rewards, next_ids, steps_to_end = transitions(state_ids, float(result))
+        expected = lambda_returns_reference(engine.q_table, state_ids, actions, rewards, next_ids, 0.3, 0.9,
+                                            trace_decay)
+        engine.learn_episodes(state_ids, actions, rewards, next_ids, steps_to_end)
+        np.testing.assert_allclose(engine.q_table, expected)
+
+
+def test_full_traces_give_monte_carlo_returns():
+    engine = QLearningEngine('q', learning_rate=0.5, discount_factor=1.0, trace_decay=1.0)
+    state_ids, actions, _ = random_episode(np.random.default_rng(1))
+    engine.learn_episodes(state_ids, actions, *transitions(state_ids, 1.0))
+    np.testing.assert_allclose(engine.q_table[state_ids, actions], 0.5)
+    assert np.count_nonzero(engine.q_table) == len(state_ids)
+
+
+@pytest.mark.parametrize('engine_class', [QLearningEngine, AfterstateEngine])
+def test_learn_batch_matches_resolve_game(engine_class):
+    rng = np.random.default_rng(2)
+    state_ids, actions, result = random_episode(rng, 2)
+    one, batch = engine_class('one', trace_decay=0.5), engine_class('batch', trace_decay=0.5)
+    for state_id, action in zip(state_ids, actions):
+        one.trajectory.record(state_id, action)
+    one.resolve_game({WIN: 'W', DRAW: 'D', LOSS: 'L'}[result])
+    # A second game's result without moves is not an episode.
+    batch.learn_batch(np.zeros(len(state_ids), dtype=np.int64), state_ids, actions, np.array([result, WIN]))
+    np.testing.assert_allclose(batch.get_policy(), one.get_policy())
+    assert one.episodes == batch.episodes == 1
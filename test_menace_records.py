@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from menace_records import GameLogWriter, GameRecord, read_engine_names, read_game_batches, read_games
+
+
+def random_games(rng, n_games, names):
+    games = []
+    for _ in range(n_games):
+        player1, player2 = rng.choice(names, 2, replace=False).tolist()
+        moves = tuple(rng.permutation(9)[:rng.integers(1, 10)].tolist())
+        games.append(GameRecord(player1, player2, moves, int(rng.integers(3))))
+    return games
+
+
+def batch_records(path, chunk_size):
+    games = []
+    for batch in read_game_batches(path, chunk_size):
+        for id1, id2, moves, n_moves, winner in zip(batch.player1, batch.player2, batch.moves, batch.n_moves,
+                                                    batch.winners):
+            assert not moves[n_moves:].any()
+            games.append(GameRecord(batch.names[id1], batch.names[id2], tuple(moves[:n_moves].tolist()), int(winner)))
+    return games
+
+
+def write_games(path, games, buffer_size=1 << 16):
+    with GameLogWriter(path, buffer_size) as writer:
+        for game in games:
+            writer.write_game(*game)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 16])
+def test_write_game_round_trip(tmp_path, chunk_size):
+    path = tmp_path / 'games.log'
+    games = random_games(np.random.default_rng(0), 500, ['menace', 'qlearning', 'afterstate', 'héllo'])
+    assert any(len(game.moves) % 2 for game in games) and any(len(game.moves) % 2 == 0 for game in games)
+    write_games(path, games, buffer_size=64)
+    assert list(read_games(path, chunk_size)) == games
+    assert batch_records(path, chunk_size) == games
+
+
+def test_write_batch_round_trip(tmp_path):
+    path = tmp_path / 'games.log'
+    rng = np.random.default_rng(1)
+    n_games = 300
+    n_moves = rng.integers(5, 10, n_games).astype(np.uint8)
+    moves = np.array([rng.permutation(9) for _ in range(n_games)], dtype=np.uint8)
+    moves[np.arange(9) >= n_moves[:, None]] = 0
+    winners = rng.integers(3, size=n_games).astype(np.int8)
+    a_first = rng.random(n_games) < 0.5
+    with GameLogWriter(path) as writer:
+        writer.write_batch('A', 'B', a_first, moves, n_moves, winners)
+
+    expected = [GameRecord(*(('A', 'B') if first else ('B', 'A')), tuple(row[:n].tolist()), int(winner))
+                for first, row, n, winner in zip(a_first, moves, n_moves, winners)]
+    assert list(read_games(path)) == expected
+    assert batch_records(path, 100) == expected
+
+
+def test_append_to_existing_log(tmp_path):
+    path = tmp_path / 'games.log'
+    rng = np.random.default_rng(2)
+    first = random_games(rng, 50, ['a', 'b'])
+    second = random_games(rng, 50, ['b', 'c', 'd'])
+    write_games(path, first)
+    write_games(path, second)
+    # b keeps the id it was given in the first session.
+    names = read_engine_names(path)
+    assert sorted(names) == [0, 1, 2, 3] and sorted(names.values()) == ['a', 'b', 'c', 'd']
+    assert list(read_games(path)) == first + second
+    assert batch_records(path, 1 << 16) == first + second
+
+
+def test_truncated_log(tmp_path):
+    path = tmp_path / 'games.log'
+    write_games(path, [GameRecord('a', 'b', (4, 0, 8), 1)])
+    with open(path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 1)
+    with pytest.raises(ValueError, match='truncated'):
+        list(read_games(path))
+    with pytest.raises(ValueError, match='truncated'):
+        list(read_game_batches(path))
+
+
+def test_not_a_game_log(tmp_path):
+    path = tmp_path / 'games.log'
+    path.write_bytes(b'NOTALOG!\x01\x00')
+    with pytest.raises(ValueError, match='not a MENACE game log'):
+        list(read_games(path))
@@ -0,0 +1,43 @@
+from functools import lru_cache
+
+from menace_batch import LOSS, WIN, simulate
+from menace_bitboard import EMPTY_BOARD, apply_move, decode_board, has_won, legal_moves
+from menace_board import DRAW, get_state_index
+from menace_solver import OptimalPlayer, game_value, move_regret, optimal_moves, player_to_move
+
+
+@lru_cache(maxsize=None)
+def negamax(board):
+    # Plain recursive value for the player to move, on actual boards.
+    player = player_to_move(board)
+    if has_won(board, 3 - player):
+        return LOSS
+    moves = legal_moves(board)
+    if not moves:
+        return DRAW
+    return max(-negamax(apply_move(board, square, player)) for square in moves)
+
+
+def test_empty_board_is_a_draw():
+    assert game_value(decode_board(EMPTY_BOARD)) == DRAW
+    assert game_value(((0, 0, 0), (0, 0, 0), (0, 0, 0))) == DRAW
+
+
+def test_forced_win():
+    state = ((1, 1, 0), (2, 2, 0), (0, 0, 0))
+    assert game_value(state) == WIN
+    assert optimal_moves(state) == (2,)
+    assert move_regret(state, 2) == 0
+    assert move_regret(state, 8) == 2
+
+
+def test_values_match_negamax():
+    for board in get_state_index().board_positions:
+        state = decode_board(board)
+        assert game_value(state) == negamax(board), state
+        for square in optimal_moves(state):
+            assert -negamax(apply_move(board, square, player_to_move(board))) == negamax(board), (state, square)
+
+
+def test_optimal_players_always_draw():
+    assert simulate(OptimalPlayer(seed=1), OptimalPlayer(seed=2), 2000, rng=3) == (0, 2000, 0)